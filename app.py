@@ -1,237 +1,1628 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, g, has_app_context, url_for
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from datetime import datetime, date, timedelta
-import calendar
+from collections import OrderedDict
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import queue
 import threading
 import time
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.events import EVENT_JOB_ERROR
-import pytz
+from sqlalchemy import MetaData, Table, event, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+import sqlite3
+import os
+import sys
+import zlib
+
+from date_window import (
+    get_date_window,
+    get_jst_datetime,
+    make_date_key,
+    parse_date_key,
+    JST,
+    MONTH_NAMES,
+    WEEKLY_UPDATE_HOUR,
+    WEEKLY_UPDATE_MINUTE,
+)
+from app_logging import gevent_monkey, setup_logging
+from metrics import (
+    CacheMetrics,
+    RequestMetrics,
+    observe_job,
+    record_missed_job,
+    render_metrics,
+)
+
+setup_logging()
+logger = logging.getLogger(__name__)
+# SQLの一覧付きの遅いリクエストのログ（LOG_LEVELS で個別にレベルを変えられるよう分けておく）
+slow_request_logger = logging.getLogger(f'{__name__}.slow_requests')
+
+try:
+    import fcntl
+except ImportError:  # Windowsなど fcntl がない環境
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # Brotli が入っていない環境では gzip だけで圧縮する
+    brotli = None
+
+def is_cooperative_worker():
+    """gevent ワーカー（モンキーパッチ済み）で動いているかどうか"""
+    monkey = gevent_monkey()
+    return monkey is not None and monkey.is_module_patched('threading')
+
+# gevent ワーカーではSQLiteの呼び出し中は同じプロセスの他のリクエストも止まるため、
+# ロック待ちはSQLite内部で長く待たず、time.sleep（協調的に切り替わる）での再試行に任せる
+COOPERATIVE_WORKER = is_cooperative_worker()
 
 app = Flask(__name__)
 
 # CORS設定を追加
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# 日本時間のタイムゾーン設定
-JST = pytz.timezone('Asia/Tokyo')
+# SQLiteデータベース設定
+SQLITE_BUSY_TIMEOUT_MS = 200 if COOPERATIVE_WORKER else 5000
+SQLITE_CACHE_SIZE_KB = 8 * 1024
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
 
-def get_jst_date():
-    """日本時間での現在の日付を取得"""
-    return datetime.now(JST).date()
+def normalize_database_url(url):
+    """Render・Heroku形式の postgres:// を SQLAlchemy で使える postgresql:// にする"""
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
 
-def get_jst_datetime():
-    """日本時間での現在の日時を取得"""
-    return datetime.now(JST)
+def env_flag(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
-# SQLiteデータベース設定
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///reservations.db'
+def uses_queue_pool(url):
+    """接続プール（QueuePool）を使う接続先かどうか
+
+    インメモリのSQLite（sqlite:// や :memory:）は Flask-SQLAlchemy が StaticPool にするため、
+    プールの大きさなどの設定を渡すとエンジンの作成に失敗する。
+    """
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite':
+        return True
+    return url.database not in (None, '', ':memory:') and url.query.get('mode') != 'memory'
+
+def build_engine_options(url):
+    """接続先に合わせたエンジンの設定（プールの大きさ・接続の確認・作り直しの間隔は環境変数で変更できる）
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT: 1プロセスの接続プール（既定 5, 10, 10秒。インメモリのSQLiteでは使わない）
+    DB_POOL_PRE_PING: 接続を使う前に生きているか確認する（既定はSQLite以外で有効）
+    DB_POOL_RECYCLE: この秒数より古い接続は作り直す（既定はSQLiteでは無効、それ以外は1800秒）
+    """
+    is_sqlite = url.startswith('sqlite')
+    options = {
+        # ネットワーク越しのDBでは、サーバー側で切られた接続を使う前に検知して作り直す
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', not is_sqlite),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '-1' if is_sqlite else '1800')),
+        'connect_args': {
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+            'check_same_thread': False
+        } if is_sqlite else {}
+    }
+    if uses_queue_pool(url):
+        # 1プロセス内のスレッド間で接続を使い回す（SQLiteファイルでは接続の作成自体は軽い）
+        options.update({
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', '5')),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+            'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+        })
+    return options
+
+# 接続先（未設定なら instance/ のSQLiteファイル。SQLite と PostgreSQL に対応）
+DATABASE_URL = normalize_database_url(os.environ.get('DATABASE_URL') or 'sqlite:///reservations.db')
+# 保持期間を過ぎた予約・時間枠の保存先（別ファイルにしてreservations.dbを小さく保つ）
+ARCHIVE_DATABASE_URL = normalize_database_url(os.environ.get('ARCHIVE_DATABASE_URL') or 'sqlite:///archive.db')
+
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+app.config['SQLALCHEMY_BINDS'] = {
+    'archive': {'url': ARCHIVE_DATABASE_URL, **build_engine_options(ARCHIVE_DATABASE_URL)}
+}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(DATABASE_URL)
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite接続ごとに複数ワーカーでの同時アクセス向けの設定を行う
+
+    WALモードでは読み込みが書き込みをブロックせず、synchronous=NORMAL で
+    コミットごとのfsyncを減らす（WALでは電源断時も破損しない）。
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    """実行したSQLをリクエストごとの集計（/metrics・遅いリクエストのログ）に加える"""
+    seconds = time.perf_counter() - conn.info['statement_started'].pop()
+    if has_app_context():
+        request_metrics = g.get('request_metrics')
+        if request_metrics is not None:
+            request_metrics.add_statement(statement, seconds, executemany)
+
+SQLITE_BUSY_RETRIES = 12 if COOPERATIVE_WORKER else 5
+SQLITE_BUSY_RETRY_WAIT = 0.05
+SQLITE_BUSY_RETRY_MAX_WAIT = 0.5
+
+# PostgreSQL で再試行すれば成功するエラー（serialization_failure, deadlock_detected）
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+def is_database_busy(error):
+    """SQLITE_BUSY（database is locked）、または PostgreSQL の直列化の失敗・デッドロックによるエラーかどうか"""
+    orig = getattr(error, 'orig', error)
+    if getattr(orig, 'pgcode', None) in RETRYABLE_PGCODES:
+        return True
+    message = str(orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def run_with_busy_retry(write):
+    """書き込み処理（commitまで）を実行し、SQLITE_BUSY の場合はロールバックして再試行する"""
+    for attempt in range(SQLITE_BUSY_RETRIES + 1):
+        try:
+            return write()
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == SQLITE_BUSY_RETRIES or not is_database_busy(e):
+                raise
+            logger.warning('データベースがロック中のため再試行します',
+                           extra={'attempt': attempt + 1, 'max_attempts': SQLITE_BUSY_RETRIES})
+            time.sleep(min(SQLITE_BUSY_RETRY_WAIT * (2 ** attempt), SQLITE_BUSY_RETRY_MAX_WAIT))
+
+# ON CONFLICT 付きの INSERT 文（SQLite と PostgreSQL で書き方は同じ）
+UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+def upsert_insert(table, engine=None):
+    """接続先のDBに合わせた、on_conflict_do_update / on_conflict_do_nothing を使える INSERT 文"""
+    return UPSERT_INSERTS[(engine or db.engine).dialect.name](table)
+
 # モデル定義（予約データ）
 class PracticeRequest(db.Model):
+    __table_args__ = (
+        # 1人1日1件（同じ日の再送信は上書き）
+        db.Index('uq_practice_request_date_user_name', 'date', 'user_name', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    date_key = db.Column(db.String(20), nullable=False)  # "YYYY-M-D"
+    date = db.Column(db.Date, nullable=False)
     user_name = db.Column(db.String(50), nullable=False)
     band_name = db.Column(db.String(100), nullable=False)  # バンド名フィールドを追加
     time_slot = db.Column(db.String(50), nullable=False)
 
+    @property
+    def date_key(self):
+        return make_date_key(self.date)
+
     def __repr__(self):
         return f"<PracticeRequest {self.date_key} {self.user_name} {self.band_name} {self.time_slot}>"
 
 # モデル定義（時間枠データ）
 class TimeSlot(db.Model):
+    __table_args__ = (
+        db.Index('ix_time_slot_date_slot', 'date', 'slot'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    date_key = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     slot = db.Column(db.String(50), nullable=False)
 
+    @property
+    def date_key(self):
+        return make_date_key(self.date)
+
 # モデル定義（時間枠変更の一時保存）
 class TimeSlotChange(db.Model):
+    __table_args__ = (
+        db.Index('ix_time_slot_change_date', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    date_key = db.Column(db.String(20), nullable=False)
+    date = db.Column(db.Date, nullable=False)
     slot = db.Column(db.String(50), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-# DB作成
-try:
-    with app.app_context():
-        db.create_all()
-        
-        # 初期時間帯を設定（既存のデータがない場合のみ）
-        existing_slots = TimeSlot.query.first()
-        if not existing_slots:
-            # 今日を含む週の日曜日を計算（日本時間）
-            today = get_jst_date()
-            days_since_sunday = today.weekday() + 1  # 月曜日=0なので+1して日曜日=0にする
-            if days_since_sunday == 7:  # 日曜日の場合は0にする
-                days_since_sunday = 0
-            current_week_sunday = today - timedelta(days=days_since_sunday)
-            
-            # 3週間分の日曜日から土曜日まで（21日間）にデフォルト時間帯を設定
-            for week in range(3):  # 3週間
-                week_start = current_week_sunday + timedelta(weeks=week)
-                for day in range(7):  # 日曜日から土曜日まで
-                    current_date = week_start + timedelta(days=day)
-                    date_key = f"{current_date.year}-{current_date.month}-{current_date.day}"
-                    default_slots = get_default_slots(current_date.year, current_date.month, current_date.day)
-                    
-                    for slot in default_slots:
-                        db.session.add(TimeSlot(date_key=date_key, slot=slot))
-            
+    @property
+    def date_key(self):
+        return make_date_key(self.date)
+
+# モデル定義（日付・時間枠ごとの予約数）
+class SlotOccupancy(db.Model):
+    """日付・時間枠ごとの予約数（予約の登録・変更・キャンセルと同じトランザクションで更新する）
+
+    capacity はその時間枠の定員（None なら SLOT_CAPACITY、どちらもなければ無制限）。
+    """
+    __table_args__ = (
+        db.Index('uq_slot_occupancy_date_slot', 'date', 'slot', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    slot = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    capacity = db.Column(db.Integer)
+
+# 時間枠ごとの定員の既定値（未設定なら無制限。管理画面から日付・時間枠ごとに上書きできる）
+SLOT_CAPACITY = int(os.environ['SLOT_CAPACITY']) if os.environ.get('SLOT_CAPACITY') else None
+
+def effective_capacity(capacity):
+    return capacity if capacity is not None else SLOT_CAPACITY
+
+# モデル定義（時間枠の作成規則）
+class SlotRule(db.Model):
+    """曜日（・祝日）ごとに作成する時間枠（position の順に並べる）
+
+    day_type は date.weekday() と同じ 0:月〜6:日、祝日は HOLIDAY_DAY_TYPE。
+    """
+    __table_args__ = (
+        db.Index('ix_slot_rule_day_type_position', 'day_type', 'position'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day_type = db.Column(db.Integer, nullable=False)
+    slot = db.Column(db.String(50), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+
+# モデル定義（祝日）
+class Holiday(db.Model):
+    """曜日ではなく祝日の規則で時間枠を作る日付（祝日・休校日など）"""
+    __table_args__ = (
+        db.Index('uq_holiday_date', 'date', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(100), nullable=False, default='')
+
+# モデル定義（データ更新バージョン）
+class DataVersion(db.Model):
+    """書き込みのたびに増えるバージョン番号（全ワーカーでDBを介して共有）"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+DATA_VERSION_ID = 1
+
+def ensure_data_version():
+    """データバージョンの行がなければ作成する"""
+    if db.session.get(DataVersion, DATA_VERSION_ID) is None:
+        db.session.add(DataVersion(id=DATA_VERSION_ID, version=0))
+        try:
             db.session.commit()
-            print("初期時間帯を設定しました")
-        
-        print("データベースが正常に初期化されました")
-except Exception as e:
-    print(f"データベース初期化でエラーが発生しました: {e}")
-
-calendar.setfirstweekday(calendar.SUNDAY)
-
-# スケジューラー初期化（Render環境での安定性向上）
-scheduler = BackgroundScheduler(
-    timezone='Asia/Tokyo',
-    daemon=True,
-    job_defaults={
-        'coalesce': True,
-        'max_instances': 1,
-        'misfire_grace_time': 300
+        except IntegrityError:
+            # 他のワーカーが同時に作成した場合
+            db.session.rollback()
+
+def bump_data_version():
+    """現在のトランザクション内でデータバージョンを進める（commitは呼び出し側で行う）"""
+    db.session.execute(
+        db.update(DataVersion)
+        .where(DataVersion.id == DATA_VERSION_ID)
+        .values(version=DataVersion.version + 1)
+    )
+
+class SchemaState(db.Model):
+    """DBの初期化（移行・テーブル作成・初期時間帯の設定）を済ませたスキーマのバージョン"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
+SCHEMA_STATE_ID = 1
+# モデルの変更や移行処理を追加したら上げる（次の起動時に初期化処理をやり直す）
+SCHEMA_VERSION = 3
+
+def get_data_version():
+    """現在のデータバージョンを取得"""
+    version = db.session.execute(
+        db.select(DataVersion.version).where(DataVersion.id == DATA_VERSION_ID)
+    ).scalar()
+    return version or 0
+
+# モデル定義（時間枠・予約の変更通知）
+class SlotEvent(db.Model):
+    """時間枠・予約が変わった日付の記録（各ワーカーがポーリングしてSSEで配信する）"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+
+# モデル定義（アーカイブ済みの予約・時間枠）
+class ArchivedPracticeRequest(db.Model):
+    """保持期間を過ぎた予約（元のテーブルと同じく1人1日1件）"""
+    __bind_key__ = 'archive'
+    __table_args__ = (
+        db.Index('uq_archived_practice_request_date_user_name', 'date', 'user_name', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    user_name = db.Column(db.String(50), nullable=False)
+    band_name = db.Column(db.String(100), nullable=False)
+    time_slot = db.Column(db.String(50), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ArchivedTimeSlot(db.Model):
+    """保持期間を過ぎた時間枠（同じ日の同じ時間枠は1件にまとめる）"""
+    __bind_key__ = 'archive'
+    __table_args__ = (
+        db.Index('uq_archived_time_slot_date_slot', 'date', 'slot', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    slot = db.Column(db.String(50), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# 変更通知は最新の件数分だけ残す（接続中のクライアントに配信できれば不要になる）
+SLOT_EVENT_RETENTION = 1000
+
+def record_slot_events(dates):
+    """現在のトランザクション内で変更のあった日付を記録する（commitは呼び出し側で行う）"""
+    rows = [{'date': d} for d in sorted(set(dates))]
+    if not rows:
+        return
+    db.session.execute(db.insert(SlotEvent), rows)
+    db.session.execute(
+        db.delete(SlotEvent).where(
+            SlotEvent.id <= db.select(db.func.max(SlotEvent.id)).scalar_subquery() - SLOT_EVENT_RETENTION
+        )
+    )
+
+def increment_slot_occupancy(target_date, slot):
+    """現在のトランザクション内で予約数を1増やす（定員に達している場合は増やさずにFalseを返す）
+
+    行がなければ0件の行を先に作り、定員の確認と加算は1文のUPDATEで行うため、
+    その時間枠の最初の予約も含めて、同時に送信されても定員を超えない。
+    書き込みのロック中に実行されるため、ORMの更新処理を通さずテーブルに対して実行する。
+    """
+    table = SlotOccupancy.__table__
+    db.session.execute(
+        upsert_insert(table).values(date=target_date, slot=slot, count=0)
+        .on_conflict_do_nothing(index_elements=['date', 'slot'])
+    )
+    capacity = table.c.capacity
+    if SLOT_CAPACITY is not None:
+        capacity = db.func.coalesce(capacity, SLOT_CAPACITY)
+    stmt = (
+        db.update(table)
+        .where(table.c.date == target_date, table.c.slot == slot,
+               db.or_(capacity.is_(None), table.c.count < capacity))
+        .values(count=table.c.count + 1)
+    )
+    return db.session.execute(stmt).rowcount > 0
+
+def decrement_slot_occupancy(target_date, slot, amount=1):
+    """現在のトランザクション内で予約数を減らす（commitは呼び出し側で行う）"""
+    table = SlotOccupancy.__table__
+    db.session.execute(
+        db.update(table)
+        .where(table.c.date == target_date, table.c.slot == slot)
+        .values(count=table.c.count - amount)
+    )
+
+def reconcile_slot_occupancy():
+    """予約数を予約の行から数え直し、ずれていた日付・時間枠を直す
+
+    数え直しから修正までを1つの書き込みトランザクションで行う。修正した内容のリストを返す（通常は空）。
+    """
+    def reconcile():
+        # 先に書き込みを行って書き込みロックを取り、数え直しの間に予約が変わらないようにする
+        bump_data_version()
+        actual = {
+            (row.date, row.time_slot): row.count
+            for row in db.session.execute(
+                db.select(PracticeRequest.date, PracticeRequest.time_slot, db.func.count().label('count'))
+                .group_by(PracticeRequest.date, PracticeRequest.time_slot)
+            )
+        }
+        stored = {
+            (row.date, row.slot): row
+            for row in db.session.execute(
+                db.select(SlotOccupancy.id, SlotOccupancy.date, SlotOccupancy.slot,
+                          SlotOccupancy.count, SlotOccupancy.capacity)
+            )
+        }
+
+        fixes = []
+        fixed_dates = set()
+        new_rows = []
+        for (row_date, slot), count in actual.items():
+            row = stored.get((row_date, slot))
+            if row is None:
+                new_rows.append({'date': row_date, 'slot': slot, 'count': count})
+            elif row.count != count:
+                db.session.execute(db.update(SlotOccupancy).where(SlotOccupancy.id == row.id).values(count=count))
+            else:
+                continue
+            fixes.append({'date': make_date_key(row_date), 'slot': slot,
+                          'stored': row.count if row is not None else None, 'actual': count})
+            fixed_dates.add(row_date)
+        for (row_date, slot), row in stored.items():
+            # 予約がなくなった行は0件として残す（過去の日付の行はアーカイブ時に削除する）
+            if (row_date, slot) not in actual and row.count != 0:
+                db.session.execute(db.update(SlotOccupancy).where(SlotOccupancy.id == row.id).values(count=0))
+                fixes.append({'date': make_date_key(row_date), 'slot': slot, 'stored': row.count, 'actual': 0})
+                fixed_dates.add(row_date)
+        if new_rows:
+            db.session.execute(db.insert(SlotOccupancy), new_rows)
+
+        if not fixes:
+            # ずれがなければデータバージョンも進めない
+            db.session.rollback()
+            return fixes
+        record_slot_events(fixed_dates)
+        db.session.commit()
+        return fixes
+
+    return run_with_busy_retry(reconcile)
+
+# 時間枠をすべて削除する変更を表す一時保存用のマーカー
+EMPTY_SLOTS_MARKER = '__EMPTY_SLOTS__'
+
+def migrate_date_key_columns():
+    """旧スキーマの文字列 date_key 列を日付型の date 列へ移行する
+
+    SQLiteは列の型変更ができないため、旧テーブルを退避して新テーブルを作成し、
+    "YYYY-M-D" 文字列を日付に変換しながら行をコピーする。
+    """
+    migrated = []
+    inspector = db.inspect(db.engine)
+    for model in (PracticeRequest, TimeSlot, TimeSlotChange):
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        if 'date_key' not in columns:
+            continue
+
+        legacy_name = f"_legacy_{table.name}"
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table.name} RENAME TO {legacy_name}'))
+            table.create(conn)
+            legacy_table = Table(legacy_name, MetaData(), autoload_with=conn)
+            rows = []
+            seen_reservations = set()
+            for row in conn.execute(legacy_table.select().order_by(legacy_table.c.id)).mappings():
+                values = {key: value for key, value in row.items() if key != 'date_key'}
+                values['date'] = parse_date_key(row['date_key'])
+                if model is PracticeRequest:
+                    # 一意インデックスに合わせて同じ日・同じ名前の重複は最初の行だけ残す
+                    reservation_key = (values['date'], values['user_name'])
+                    if reservation_key in seen_reservations:
+                        continue
+                    seen_reservations.add(reservation_key)
+                rows.append(values)
+            if rows:
+                conn.execute(table.insert(), rows)
+            conn.execute(text(f'DROP TABLE {legacy_name}'))
+        migrated.append(table.name)
+    return migrated
+
+def migrate_practice_request_unique_index():
+    """予約の (date, user_name) 重複を削除し、一意インデックスに置き換える
+
+    これまでの更新は最初の行（idが最小）に対して行われていたため、その行を残す。
+    削除した重複行の件数を返す。
+    """
+    inspector = db.inspect(db.engine)
+    table_name = PracticeRequest.__table__.name
+    if not inspector.has_table(table_name):
+        return 0
+    index_names = {index['name'] for index in inspector.get_indexes(table_name)}
+    if 'uq_practice_request_date_user_name' in index_names:
+        return 0
+
+    with db.engine.begin() as conn:
+        removed = conn.execute(text(
+            f'DELETE FROM {table_name} WHERE id NOT IN '
+            f'(SELECT MIN(id) FROM {table_name} GROUP BY date, user_name)'
+        )).rowcount
+        conn.execute(text('DROP INDEX IF EXISTS ix_practice_request_date_user_name'))
+        conn.execute(text(
+            f'CREATE UNIQUE INDEX uq_practice_request_date_user_name ON {table_name} (date, user_name)'
+        ))
+    return removed
+
+def load_calendar_data(start_date, end_date, include_pending=False, include_users=True):
+    """指定期間の時間枠・予約数・予約者（・一時保存された変更）をまとめて取得する
+
+    テーブルごとに1クエリ（最大4クエリ）で期間内の行を読み込み、
+    画面・APIで使う辞書構造にメモリ上でグループ化して返す。
+    予約の有無・予約数は集計済みの SlotOccupancy から求めるため、
+    include_users=False なら予約の行は読み込まない（期間内の時間枠の数に比例する）。
+    """
+    time_slots = {}
+    for slot in TimeSlot.query.filter(
+        TimeSlot.date.between(start_date, end_date)
+    ).order_by(TimeSlot.id):
+        time_slots.setdefault(slot.date_key, []).append(slot.slot)
+
+    # 各日付の時間枠ごとの (予約数, 定員)
+    occupancy = {}
+    booked_dates = set()
+    for row in db.session.execute(
+        db.select(SlotOccupancy.date, SlotOccupancy.slot, SlotOccupancy.count, SlotOccupancy.capacity)
+        .where(SlotOccupancy.date.between(start_date, end_date))
+    ):
+        date_key = make_date_key(row.date)
+        occupancy.setdefault(date_key, {})[row.slot] = (row.count, effective_capacity(row.capacity))
+        if row.count > 0:
+            booked_dates.add(date_key)
+
+    # 各日付の時間枠ごとの予約者リスト
+    practice_users = {
+        date_key: {slot: [] for slot in slots}
+        for date_key, slots in time_slots.items()
     }
-)
+    practice_requests = {}
+    if include_users:
+        for req in PracticeRequest.query.filter(
+            PracticeRequest.date.between(start_date, end_date)
+        ).order_by(PracticeRequest.id):
+            date_key = req.date_key
+            practice_requests.setdefault(date_key, {})[req.user_name] = {
+                'time_slot': req.time_slot,
+                'band_name': req.band_name
+            }
+            users_per_slot = practice_users.get(date_key, {})
+            if req.time_slot in users_per_slot:
+                # 予約者名とバンド名を含むオブジェクトを作成
+                users_per_slot[req.time_slot].append({
+                    'name': req.user_name,
+                    'band_name': req.band_name
+                })
+
+    pending_changes = {}
+    if include_pending:
+        for change in TimeSlotChange.query.filter(
+            TimeSlotChange.date.between(start_date, end_date)
+        ).order_by(TimeSlotChange.id):
+            # 空のマーカーの場合は空のリストとして処理
+            if change.slot == EMPTY_SLOTS_MARKER:
+                pending_changes[change.date_key] = []
+            else:
+                pending_changes.setdefault(change.date_key, []).append(change.slot)
+
+    return {
+        'time_slots': time_slots,
+        'occupancy': occupancy,
+        'practice_users': practice_users,
+        'practice_requests': practice_requests,
+        'booked_dates': booked_dates,
+        'pending_changes': pending_changes
+    }
+
+class VersionedLRUCache:
+    """データバージョン付きで値を保持するプロセス内キャッシュ（LRUで件数を制限）
+
+    保存時のバージョンと現在のバージョンが一致する間だけ再利用する。
+    バージョンはDBに保存されているため、他のワーカーでの書き込みも検知できる。
+    """
+
+    def __init__(self, name, max_entries=32):
+        self.name = name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = CacheMetrics(name)
+
+    def get(self, key, version, loader):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                self._metrics.observe(True, self.hits, self.misses, len(self._entries))
+                return entry[1]
+            self.misses += 1
+
+        data = loader()
+        with self._lock:
+            self._entries[key] = (version, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._metrics.observe(False, self.hits, self.misses, len(self._entries))
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'entries': len(self._entries)
+            }
+
+# 期間ごとのカレンダーデータ
+calendar_cache = VersionedLRUCache('calendar', max_entries=32)
+# 描画済みのHTML断片（トップページの月カレンダー・管理画面の週ブロック）
+fragment_cache = VersionedLRUCache('fragments', max_entries=64)
+
+def get_calendar_snapshot(start_date, end_date, version=None, include_pending=False, include_users=True):
+    """指定期間のカレンダーデータをキャッシュ経由で取得（返り値は変更しないこと）"""
+    # 読み込み中に書き込まれても古いデータが新しいバージョンで保存されないよう、先にバージョンを取得する
+    if version is None:
+        version = get_data_version()
+    return calendar_cache.get(
+        (start_date, end_date, include_pending, include_users),
+        version,
+        lambda: load_calendar_data(start_date, end_date, include_pending, include_users)
+    )
+
+def render_cached_fragment(key, version, template_name, context_loader):
+    """HTML断片を描画してキャッシュする（日付・データバージョンが同じ間は再描画しない）
+
+    context_loader はキャッシュがない場合だけ呼ばれ、テンプレートに渡す値を返す。
+    """
+    return fragment_cache.get(
+        key,
+        version,
+        lambda: Markup(render_template(template_name, **context_loader()))
+    )
+
+def build_slot_deltas(dates):
+    """変更のあった日付ごとの時間枠・予約者（SSEで配信する差分）を作成
+
+    画面に表示される期間（トップページの月カレンダー・受付期間と管理画面の3週間）の日付だけを読み込む。
+    学期分の一括作成のように、変更の大部分が表示期間の外にあっても読み込みは表示期間の分で済む。
+    """
+    window = get_date_window()
+    start = window.display_start
+    end = max(window.display_end, window.admin_end)
+    dates = sorted({d for d in dates if start <= d <= end})
+    if not dates:
+        return []
+    calendar_data = load_calendar_data(dates[0], dates[-1])
+    deltas = []
+    for changed_date in dates:
+        date_key = make_date_key(changed_date)
+        deltas.append({
+            'date': date_key,
+            'time_slots': build_slot_payload(calendar_data, date_key),
+            'booked': date_key in calendar_data['booked_dates']
+        })
+    return deltas
+
+class SlotEventBroker:
+    """SSE接続ごとのキューへ変更の差分を配る（プロセス内のpub/sub）
+
+    他のワーカーでの書き込みも届くよう、DBの SlotEvent を短い間隔でポーリングする。
+    ポーリングは購読者がいる間だけバックグラウンドスレッドで行う。
+    1回のポーリングで見つかった差分は1件のメッセージ（{"deltas": [...]}）にまとめて配るため、
+    一括作成などで多くの日付が変わってもキューがあふれて接続が切られることはない。
+    """
+
+    def __init__(self, poll_interval=1.0, queue_size=64):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_event_id = None
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='slot-event-poller', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # 読み出しが追いつかない接続は切断する（クライアントが再接続して取り直す）
+                self.unsubscribe(subscriber)
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def poll(self):
+        """前回以降の変更通知を読み込み、日付ごとの差分を購読者に配る"""
+        with app.app_context():
+            if self._last_event_id is None:
+                # 開始時点より前の通知は配信しない
+                self._last_event_id = db.session.execute(db.select(db.func.max(SlotEvent.id))).scalar() or 0
+                return
+            events = db.session.execute(
+                db.select(SlotEvent.id, SlotEvent.date)
+                .where(SlotEvent.id > self._last_event_id)
+                .order_by(SlotEvent.id)
+            ).all()
+            if not events:
+                return
+            self._last_event_id = events[-1].id
+            deltas = build_slot_deltas(event.date for event in events)
+        if deltas:
+            self.publish({'deltas': deltas})
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # 次の購読者が来たときは、その時点から配信し直す
+                    self._thread = None
+                    self._last_event_id = None
+                    return
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('変更通知の取得でエラーが発生しました')
+            time.sleep(self.poll_interval)
+
+slot_event_broker = SlotEventBroker()
+
+# 祝日の規則の day_type と、APIでの day_type の名前（0:月〜6:日、7:祝日）
+HOLIDAY_DAY_TYPE = 7
+DAY_TYPE_NAMES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun', 'holiday')
+# 時間枠の作成規則の初期値
+DEFAULT_SLOT_RULES = {
+    0: ['〜16:50', '16:50〜18:00'],
+    1: ['16:50〜18:00'],
+    2: ['〜16:50', '16:50〜18:00'],
+    3: ['16:50〜18:00'],
+    4: ['16:50〜18:00'],
+    5: ['12:30~14:30', '14:30~16:30'],
+    6: ['12:30~14:30', '14:30~16:30'],
+    HOLIDAY_DAY_TYPE: ['12:30~14:30', '14:30~16:30'],
+}
+# 週次の補充で時間枠を作らない曜日（土曜日・日曜日は管理画面から設定する）
+TOP_UP_SKIPPED_WEEKDAYS = (5, 6)
+# 一度に時間枠を作成できる期間（1年分まで）
+SLOT_GENERATION_MAX_DAYS = 366
+
+def ensure_slot_rules():
+    """時間枠の作成規則がなければ初期値で作成する（commitは呼び出し側で行う）"""
+    if db.session.execute(db.select(SlotRule.id).limit(1)).first() is not None:
+        return
+    db.session.execute(db.insert(SlotRule), [
+        {'day_type': day_type, 'slot': slot, 'position': position}
+        for day_type, slots in DEFAULT_SLOT_RULES.items()
+        for position, slot in enumerate(slots)
+    ])
+
+def load_slot_rules():
+    """day_type ごとの時間枠のリスト"""
+    rules = {}
+    for row in db.session.execute(
+        db.select(SlotRule.day_type, SlotRule.slot).order_by(SlotRule.day_type, SlotRule.position, SlotRule.id)
+    ):
+        rules.setdefault(row.day_type, []).append(row.slot)
+    return rules
+
+def plan_time_slots(start_date, end_date, skip_weekdays=()):
+    """期間内の時間枠のない日付に、規則から作成する時間枠を求める（DBには書き込まない）
+
+    規則・祝日・既存の時間枠の日付をそれぞれ1クエリで読み込んで求める。
+    返り値は (日付ごとの時間枠の辞書, 既に時間枠があるため対象外にした日数)。
+    """
+    rules = load_slot_rules()
+    holidays = set(db.session.execute(
+        db.select(Holiday.date).where(Holiday.date.between(start_date, end_date))
+    ).scalars())
+    existing = set(db.session.execute(
+        db.select(TimeSlot.date).where(TimeSlot.date.between(start_date, end_date)).distinct()
+    ).scalars())
+
+    plan = {}
+    current = start_date
+    while current <= end_date:
+        if current not in existing and current.weekday() not in skip_weekdays:
+            slots = rules.get(HOLIDAY_DAY_TYPE if current in holidays else current.weekday())
+            if slots:
+                plan[current] = slots
+        current += timedelta(days=1)
+    return plan, len(existing)
+
+def rule_slots_for_date(target_date):
+    """1日分の規則の時間枠（祝日なら祝日の規則。既存の時間枠・変更予定には関係なく返す）"""
+    is_holiday = db.session.execute(
+        db.select(Holiday.id).where(Holiday.date == target_date)
+    ).first() is not None
+    return load_slot_rules().get(HOLIDAY_DAY_TYPE if is_holiday else target_date.weekday(), [])
+
+def generate_time_slots(start_date, end_date, skip_weekdays=()):
+    """期間内の時間枠のない日付に規則から時間枠を作成する（全日付分を1回の一括INSERTで行う）
+
+    返り値は plan_time_slots() と同じ（作成した時間枠と、対象外にした日数）。
+    """
+    def generate():
+        # 先に書き込みロックを取り、時間枠の確認から作成までの間に他の書き込みを挟ませない
+        bump_data_version()
+        plan, skipped = plan_time_slots(start_date, end_date, skip_weekdays)
+        if not plan:
+            db.session.rollback()
+            return plan, skipped
+        db.session.execute(db.insert(TimeSlot), [
+            {'date': slot_date, 'slot': slot}
+            for slot_date, slots in sorted(plan.items())
+            for slot in slots
+        ])
+        record_slot_events(plan)
+        db.session.commit()
+        return plan, skipped
+
+    return run_with_busy_retry(generate)
+
+def time_slot_plan_report(plan, skipped):
+    return {
+        'dates': {slot_date.isoformat(): slots for slot_date, slots in sorted(plan.items())},
+        'date_count': len(plan),
+        'slot_count': sum(len(slots) for slots in plan.values()),
+        'skipped_existing': skipped
+    }
+
+class ProcessFileLock:
+    """ワーカープロセス間の排他ロック（fcntl.flock）
+
+    ロックはファイル記述子に紐づくため、保持しているプロセスが異常終了しても
+    OSによって解放され、待機中の別プロセスが取得できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is None:
+            # ロック機構がない環境では単一プロセスとして扱う
+            self._fd = fd
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def locked(self):
+        """このプロセスか他のプロセスがロックを保持しているかどうか"""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # 共有ロックが取れなければ他のプロセスが排他ロックを保持している（取れた場合は close で解放される）
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+os.makedirs(app.instance_path, exist_ok=True)
+# DB初期化は1プロセスずつ順番に行う（先に終えたプロセスの結果を後続は確認するだけになる）
+db_init_lock = ProcessFileLock(os.path.join(app.instance_path, 'db_init.lock'))
+# スケジューラーはロックを取得した1プロセス（リーダー）だけが動かす
+scheduler_leader_lock = ProcessFileLock(os.path.join(app.instance_path, 'scheduler.lock'))
+
+def database_initialized():
+    """このバージョンのスキーマへの移行・初期時間帯の設定が済んでいるかどうか"""
+    try:
+        return db.session.execute(
+            db.select(SchemaState.version).where(SchemaState.id == SCHEMA_STATE_ID)
+        ).scalar() == SCHEMA_VERSION
+    except SQLAlchemyError:
+        # 初回（テーブルがない）
+        db.session.rollback()
+        return False
+
+def initialize_database():
+    """DBの移行・テーブル作成・初期時間帯の設定を行う
+
+    済んでいれば SchemaState の1行を確認するだけで戻る。
+    未完了の場合は1プロセスずつ順番に行う（先に終えたプロセスの結果を後続は確認するだけになる）。
+    """
+    with app.app_context():
+        if database_initialized():
+            return
+        with db_init_lock:
+            if database_initialized():
+                return
+            migrated_tables = migrate_date_key_columns()
+            if migrated_tables:
+                logger.info('date列への移行を行いました', extra={'tables': migrated_tables})
+            removed_duplicates = migrate_practice_request_unique_index()
+            if removed_duplicates:
+                logger.info('重複していた予約を削除しました', extra={'removed': removed_duplicates})
+            db.create_all()
+            ensure_data_version()
+            ensure_slot_rules()
+            db.session.commit()
+
+            # 初期時間帯を設定（既存のデータがない場合のみ）
+            if TimeSlot.query.first() is None:
+                # 今週の日曜日から3週間分（21日間）にデフォルト時間帯を設定（日本時間）
+                window = get_date_window()
+                plan, _ = generate_time_slots(window.admin_start, window.admin_end)
+                logger.info('初期時間帯を設定しました', extra={'dates': len(plan)})
+
+            # 予約数の集計を追加する前のDBでは、既存の予約から作成する
+            fixes = reconcile_slot_occupancy()
+            if fixes:
+                logger.info('予約数の集計を作成しました', extra={'slots': len(fixes)})
+
+            db.session.merge(SchemaState(id=SCHEMA_STATE_ID, version=SCHEMA_VERSION))
+            db.session.commit()
+            logger.info('データベースが正常に初期化されました')
+
+# スケジューラーはリーダーのプロセスでだけ create_scheduler() で作成する
+scheduler = None
 
 # スケジューラーのエラーハンドリング
-def scheduler_error_handler(job_id, exception):
-    print(f"スケジューラーエラー (Job ID: {job_id}): {exception}")
+def scheduler_error_handler(event):
+    from apscheduler.events import EVENT_JOB_MISSED
+
+    if event.code == EVENT_JOB_MISSED:
+        logger.warning('スケジューラーのジョブが実行されませんでした', extra={'job_id': event.job_id})
+        record_missed_job(event.job_id)
+        return
+    logger.error('スケジューラーエラー', extra={'job_id': event.job_id, 'error': str(event.exception)})
     # エラーが発生してもアプリケーションを停止させない
 
-scheduler.add_listener(scheduler_error_handler, EVENT_JOB_ERROR)
+def apply_pending_time_slot_changes():
+    """一時保存された時間帯変更を1トランザクションでまとめて反映する
+
+    変更のある日付の時間枠を1回のDELETEで削除し、新しい時間枠を一括INSERTする。
+    反映した日付と、日付ごとに追加・削除された時間枠をまとめたレポートを返す。
+    """
+    def apply():
+        # 先に書き込みロックを取り、変更の読み込みから反映までの間に update_time_slots などの書き込みを挟ませない
+        bump_data_version()
+        changes = db.session.execute(
+            db.select(TimeSlotChange.id, TimeSlotChange.date, TimeSlotChange.slot)
+            .order_by(TimeSlotChange.id)
+        ).all()
+        if not changes:
+            db.session.rollback()
+            return {'change_count': 0, 'dates': [], 'added': {}, 'removed': {},
+                    'slots_added': 0, 'slots_removed': 0}
+
+        # 日付ごとに新しい時間枠をまとめる（空のマーカーの日付は時間枠なし）
+        new_slots_by_date = {}
+        for change in changes:
+            slots = new_slots_by_date.setdefault(change.date, [])
+            if change.slot != EMPTY_SLOTS_MARKER:
+                slots.append(change.slot)
+
+        # 読み込んだ変更までを対象にする（反映中に追加された変更は次回に回す）
+        max_change_id = changes[-1].id
+        changed_dates = (
+            db.select(TimeSlotChange.date)
+            .where(TimeSlotChange.id <= max_change_id)
+            .scalar_subquery()
+        )
+
+        old_slots_by_date = {}
+        for row in db.session.execute(
+            db.select(TimeSlot.date, TimeSlot.slot)
+            .where(TimeSlot.date.in_(changed_dates))
+            .order_by(TimeSlot.id)
+        ):
+            old_slots_by_date.setdefault(row.date, []).append(row.slot)
 
+        db.session.execute(
+            db.delete(TimeSlot).where(TimeSlot.date.in_(changed_dates))
+        )
+        new_rows = [
+            {'date': change_date, 'slot': slot}
+            for change_date, slots in new_slots_by_date.items()
+            for slot in slots
+        ]
+        if new_rows:
+            db.session.execute(db.insert(TimeSlot), new_rows)
+        # 削除された時間枠の予約数の行は、予約が残っていなければ削除する（残っている予約の件数はそのまま）
+        db.session.execute(
+            db.delete(SlotOccupancy).where(
+                SlotOccupancy.date.in_(changed_dates),
+                SlotOccupancy.count == 0,
+                ~db.select(TimeSlot.id).where(
+                    TimeSlot.date == SlotOccupancy.date, TimeSlot.slot == SlotOccupancy.slot
+                ).exists()
+            )
+        )
+        db.session.execute(
+            db.delete(TimeSlotChange).where(TimeSlotChange.id <= max_change_id)
+        )
+        record_slot_events(new_slots_by_date)
+        db.session.commit()
+
+        added = {}
+        removed = {}
+        for change_date in sorted(new_slots_by_date):
+            new_slots = new_slots_by_date[change_date]
+            old_slots = old_slots_by_date.get(change_date, [])
+            date_added = [slot for slot in new_slots if slot not in old_slots]
+            date_removed = [slot for slot in old_slots if slot not in new_slots]
+            if date_added:
+                added[make_date_key(change_date)] = date_added
+            if date_removed:
+                removed[make_date_key(change_date)] = date_removed
+        return {
+            'change_count': len(changes),
+            'dates': [make_date_key(d) for d in sorted(new_slots_by_date)],
+            'added': added,
+            'removed': removed,
+            'slots_added': sum(len(slots) for slots in added.values()),
+            'slots_removed': sum(len(slots) for slots in removed.values())
+        }
+
+    return run_with_busy_retry(apply)
+
+@observe_job('weekly_time_slot_update')
 def apply_time_slot_changes():
     """毎週日曜日19:00に時間帯変更を反映する関数"""
     with app.app_context():
         try:
-            # 時間帯変更の一時保存データを取得
-            changes = TimeSlotChange.query.all()
-            
-            if changes:
-                # 日付ごとにグループ化
-                changes_by_date = {}
-                for change in changes:
-                    if change.date_key not in changes_by_date:
-                        changes_by_date[change.date_key] = []
-                    changes_by_date[change.date_key].append(change.slot)
-                
-                # 各日付の時間帯を更新
-                for date_key, slots in changes_by_date.items():
-                    # 既存の時間帯を削除
-                    TimeSlot.query.filter_by(date_key=date_key).delete()
-                    
-                    # 新しい時間帯を追加（空のマーカーがある場合は何も追加しない）
-                    for slot in slots:
-                        if slot != '__EMPTY_SLOTS__':
-                            db.session.add(TimeSlot(date_key=date_key, slot=slot))
-                
-                # 一時保存データを削除
-                TimeSlotChange.query.delete()
-                
-                db.session.commit()
-                print(f"時間帯変更を反映しました: {len(changes)}件")
+            report = apply_pending_time_slot_changes()
+            if report['change_count']:
+                logger.info('時間帯変更を反映しました', extra={
+                    'change_count': report['change_count'],
+                    'dates': len(report['dates']),
+                    'slots_added': report['slots_added'],
+                    'slots_removed': report['slots_removed']
+                })
             else:
-                print("反映する時間帯変更はありません")
+                logger.info('反映する時間帯変更はありません')
             
             # 新しい週のデフォルト時間帯を設定（日本時間）
-            today = get_jst_date()
-            # 3週間後の日曜日から土曜日まで（7日間）の時間帯を設定（土曜日と日曜日は除外）
-            three_weeks_later = today + timedelta(weeks=3)
-            days_since_sunday = three_weeks_later.weekday() + 1
-            if days_since_sunday == 7:
-                days_since_sunday = 0
-            week_start = three_weeks_later - timedelta(days=days_since_sunday)
-            
-            for day in range(7):  # 日曜日から土曜日まで
-                # 土曜日（day=6）と日曜日（day=0）はスキップ
-                if day == 0 or day == 6:
-                    continue
-                    
-                current_date = week_start + timedelta(days=day)
-                date_key = f"{current_date.year}-{current_date.month}-{current_date.day}"
+            # 3週間後の日曜日から土曜日まで（7日間）のうち、時間枠のない日付だけに作成する（土曜日と日曜日は除外）
+            window = get_date_window()
+            plan, _ = generate_time_slots(window.top_up_dates[0], window.top_up_dates[-1],
+                                          TOP_UP_SKIPPED_WEEKDAYS)
+            logger.info('新しい週のデフォルト時間帯を設定しました', extra={'dates': len(plan)})
                 
-                # 既存の時間帯がない場合のみデフォルト時間帯を設定
-                existing = TimeSlot.query.filter_by(date_key=date_key).first()
-                if not existing:
-                    default_slots = get_default_slots(current_date.year, current_date.month, current_date.day)
-                    for slot in default_slots:
-                        db.session.add(TimeSlot(date_key=date_key, slot=slot))
-            
-            db.session.commit()
-            print("新しい週のデフォルト時間帯を設定しました")
-                
-        except Exception as e:
-            print(f"時間帯変更の反映でエラーが発生しました: {e}")
+        except Exception:
+            logger.exception('時間帯変更の反映でエラーが発生しました')
             db.session.rollback()
+            raise
 
-# 毎週日曜日19:00にスケジュール設定
-scheduler.add_job(
-    func=apply_time_slot_changes,
-    trigger=CronTrigger(day_of_week=6, hour=19, minute=0),  # 日曜日=6, 19:00
-    id='weekly_time_slot_update',
-    name='週次時間帯更新',
-    replace_existing=True
+# この日数より前の予約・時間枠をアーカイブする（トップページに表示中の月の分は残す）
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '28'))
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVED_MODELS = (
+    (PracticeRequest, ArchivedPracticeRequest),
+    (TimeSlot, ArchivedTimeSlot),
 )
 
-# スケジューラー開始（Render環境での安定性向上）
-try:
-    if not scheduler.running:
-        scheduler.start()
-        print("スケジューラーが正常に開始されました")
-except Exception as e:
-    print(f"スケジューラーの開始でエラーが発生しました: {e}")
-    # スケジューラーが開始できない場合でもアプリケーションは継続
-
-def get_default_slots(year, month, day):
-    dt = date(year, month, day)
-    if dt.weekday() == 5 or dt.weekday() == 6:  # 5:土, 6:日
-        return ['12:30~14:30', '14:30~16:30']
-    elif dt.weekday() == 1 or dt.weekday() == 3 or dt.weekday() == 4:  # 1:火, 3:木, 4:金
-        return ['16:50〜18:00']
-    else:  # 0:月, 2:水
-        return ['〜16:50', '16:50〜18:00']
+def archive_insert(archive_model):
+    """アーカイブへのINSERT文（同じ行を再度移しても重複しない）
+
+    SQLiteは最大のidの行を削除するとidを再利用するため、元のidではなく
+    元のテーブルと同じ一意キーで重複を判定する（予約は新しい内容で上書きする）。
+    """
+    stmt = upsert_insert(archive_model.__table__, db.engines['archive'])
+    if archive_model is ArchivedPracticeRequest:
+        return stmt.on_conflict_do_update(
+            index_elements=['date', 'user_name'],
+            set_={
+                'band_name': stmt.excluded.band_name,
+                'time_slot': stmt.excluded.time_slot,
+                'archived_at': stmt.excluded.archived_at
+            }
+        )
+    return stmt.on_conflict_do_nothing(index_elements=['date', 'slot'])
+
+def get_archive_cutoff(window=None):
+    """これより前の日付の行をアーカイブ対象にする"""
+    window = window or get_date_window()
+    return min(window.today - timedelta(days=ARCHIVE_RETENTION_DAYS), window.display_start)
+
+def archive_old_rows(cutoff):
+    """cutoff より前の予約・時間枠をアーカイブDBへ移し、一時保存された過去日の変更と予約数を削除する
+
+    アーカイブDBへのコピーを先にコミットしてから元のテーブルから削除するため、
+    途中で失敗しても再実行すれば重複なく移し終えられる。
+    """
+    archive_engine = db.engines['archive']
+    archived_at = datetime.utcnow()
+    max_ids = {}
+    for model, archive_model in ARCHIVED_MODELS:
+        max_id = db.session.execute(
+            db.select(db.func.max(model.id)).where(model.date < cutoff)
+        ).scalar()
+        if max_id is None:
+            continue
+        max_ids[model] = max_id
+        columns = [column for column in model.__table__.columns if column.name != 'id']
+        insert = archive_insert(archive_model)
+        with db.engine.connect() as source, archive_engine.begin() as archive:
+            result = source.execution_options(yield_per=ARCHIVE_BATCH_SIZE).execute(
+                db.select(*columns).where(model.date < cutoff, model.id <= max_id).order_by(model.id)
+            )
+            for rows in result.partitions():
+                archive.execute(insert, [dict(row._mapping, archived_at=archived_at) for row in rows])
+    db.session.rollback()
+
+    def delete():
+        counts = {model.__table__.name: 0 for model, _ in ARCHIVED_MODELS}
+        for model, max_id in max_ids.items():
+            counts[model.__table__.name] = db.session.execute(
+                db.delete(model).where(model.date < cutoff, model.id <= max_id)
+            ).rowcount
+        counts[TimeSlotChange.__table__.name] = db.session.execute(
+            db.delete(TimeSlotChange).where(TimeSlotChange.date < cutoff)
+        ).rowcount
+        counts[SlotOccupancy.__table__.name] = db.session.execute(
+            db.delete(SlotOccupancy).where(SlotOccupancy.date < cutoff)
+        ).rowcount
+        if any(counts.values()):
+            bump_data_version()
+        db.session.commit()
+        return counts
+
+    return run_with_busy_retry(delete)
+
+def compact_database(engine):
+    """削除で空いたページをファイルから解放し、クエリプランナーの統計情報を更新する
+
+    auto_vacuum が INCREMENTAL でない既存のDBは、初回だけVACUUMで切り替える。
+    解放したページ数を返す（PostgreSQL では VACUUM ANALYZE だけを行い、0を返す）。
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        if engine.dialect.name != 'sqlite':
+            conn.exec_driver_sql('VACUUM ANALYZE')
+            return 0
+        freed_before = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:  # 2: INCREMENTAL
+            conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        else:
+            # incremental_vacuum は1ステップで1ページずつ解放するため、最後まで実行させる
+            conn.connection.dbapi_connection.executescript('PRAGMA incremental_vacuum')
+        conn.exec_driver_sql('ANALYZE')
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        freed_after = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+    return freed_before - freed_after
+
+def run_archival():
+    """アーカイブと、その後のDBの整理をまとめて行い、結果のレポートを返す"""
+    cutoff = get_archive_cutoff()
+    counts = archive_old_rows(cutoff)
+    freed_pages = compact_database(db.engine)
+    compact_database(db.engines['archive'])
+    return {'cutoff': cutoff.isoformat(), 'archived': counts, 'freed_pages': freed_pages}
+
+@observe_job('weekly_archive')
+def archive_old_data():
+    """毎週日曜日19:30に保持期間を過ぎたデータをアーカイブする関数"""
+    with app.app_context():
+        try:
+            report = run_archival()
+            logger.info('保持期間を過ぎたデータをアーカイブしました', extra=report)
+        except Exception:
+            logger.exception('アーカイブでエラーが発生しました')
+            db.session.rollback()
+            raise
+
+@observe_job('occupancy_reconcile')
+def check_slot_occupancy():
+    """1時間ごとに予約数の集計と予約の行が一致しているか確認し、ずれていれば直す関数"""
+    with app.app_context():
+        try:
+            fixes = reconcile_slot_occupancy()
+            if fixes:
+                logger.warning('予約数の集計のずれを修正しました', extra={'slots': len(fixes), 'fixes': fixes[:20]})
+        except Exception:
+            logger.exception('予約数の確認でエラーが発生しました')
+            db.session.rollback()
+            raise
+
+# (ID, 名前, 関数, CronTrigger の引数)。時刻はすべて日本時間
+SCHEDULED_JOBS = (
+    # 毎週日曜日19:00に時間帯変更を反映
+    ('weekly_time_slot_update', '週次時間帯更新', apply_time_slot_changes,
+     {'day_of_week': 6, 'hour': WEEKLY_UPDATE_HOUR, 'minute': WEEKLY_UPDATE_MINUTE}),
+    # 時間帯変更の反映の後（毎週日曜日19:30）にアーカイブ
+    ('weekly_archive', '週次アーカイブ', archive_old_data,
+     {'day_of_week': 6, 'hour': 19, 'minute': 30}),
+    # 毎時45分に予約数の集計を確認（週次のジョブと重ならない時刻）
+    ('occupancy_reconcile', '予約数の整合性チェック', check_slot_occupancy,
+     {'minute': 45}),
+)
+
+def build_job_trigger(cron):
+    from apscheduler.triggers.cron import CronTrigger
+
+    return CronTrigger(timezone=JST, **cron)
+
+def create_scheduler():
+    """ジョブを登録したスケジューラーを作成する（APSchedulerはリーダーのプロセスでだけ読み込む）"""
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    new_scheduler = BackgroundScheduler(
+        timezone=JST,
+        daemon=True,
+        job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            'misfire_grace_time': 300
+        }
+    )
+    new_scheduler.add_listener(scheduler_error_handler, EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    for job_id, name, func, cron in SCHEDULED_JOBS:
+        new_scheduler.add_job(
+            func=func,
+            trigger=build_job_trigger(cron),
+            id=job_id,
+            name=name,
+            replace_existing=True
+        )
+    return new_scheduler
+
+def start_scheduler():
+    """スケジューラー開始（Render環境での安定性向上）"""
+    global scheduler
+    try:
+        if scheduler is None:
+            scheduler = create_scheduler()
+        if not scheduler.running:
+            scheduler.start()
+            logger.info('スケジューラーが正常に開始されました')
+    except Exception:
+        logger.exception('スケジューラーの開始でエラーが発生しました')
+        # スケジューラーが開始できない場合でもアプリケーションは継続
+
+# リーダーのロックが解放されたかを確認する間隔（秒）
+SCHEDULER_LEADER_POLL_SECONDS = 10
+
+# 起動直後のリクエストと競合しないよう、スケジューラーはこの秒数だけ待ってから開始する
+# （週次のジョブは misfire_grace_time の範囲で遅れても実行される）
+SCHEDULER_START_DELAY_SECONDS = float(os.environ.get('SCHEDULER_START_DELAY_SECONDS', '5'))
+
+def run_scheduler_leader_election():
+    """リーダーになれたらスケジューラーを開始する（なれなければリーダーが終了するまで待って引き継ぐ）
+
+    ブロッキングする flock で待つと gevent ワーカーではプロセス全体が止まるため、
+    ノンブロッキングでの取得を time.sleep を挟んで繰り返す。
+    """
+    time.sleep(SCHEDULER_START_DELAY_SECONDS)
+    try:
+        if not scheduler_leader_lock.acquire(blocking=False):
+            while not scheduler_leader_lock.acquire(blocking=False):
+                time.sleep(SCHEDULER_LEADER_POLL_SECONDS)
+            logger.info('スケジューラーのリーダーを引き継ぎました')
+    except Exception:
+        logger.exception('スケジューラーのリーダー選出でエラーが発生しました')
+        return
+    start_scheduler()
+
+# この時間（ミリ秒）を超えたリクエストを実行したSQLの一覧付きでログに出す（未設定なら出さない）
+SLOW_REQUEST_MS = float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = RequestMetrics(record_statements=SLOW_REQUEST_MS is not None)
+
+@app.after_request
+def record_request_metrics(response):
+    """ルートごとの処理時間・SQLの実行数とDB時間を記録する"""
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+    # URLそのものではなくルートのパターンで集計する（存在しないURLは1つにまとめる）
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = request_metrics.finish(request.method, route, response.status_code)
+    if SLOW_REQUEST_MS is not None and elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_request_logger.warning('遅いリクエスト', extra=request_metrics.slow_log_fields(
+            request.method, request.full_path.rstrip('?'), response.status_code, elapsed))
+    return response
+
+# 圧縮して送る応答の種類と最小サイズ（小さい応答は圧縮してもほとんど減らないため、そのまま送る）
+COMPRESSIBLE_MIMETYPES = ('text/html', 'application/json')
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+# 応答のたびに圧縮するため、圧縮率より速さを優先したレベルにする
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# 圧縮した本文（同じ内容のHTML・JSONは圧縮し直さない。キーは圧縮の形式と元の本文のハッシュ）
+compressed_cache = VersionedLRUCache('compressed', max_entries=64)
+
+def choose_content_encoding(accept_encodings):
+    """Accept-Encoding から圧縮の形式を選ぶ（brotli を優先し、どちらも受け付けなければ None）"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def compressed_etag(etag, encoding):
+    """圧縮した応答のETag（圧縮の有無・形式ごとに別の内容として扱われるよう形式名を付ける）"""
+    return f'{etag}-{encoding}'
+
+@app.after_request
+def compress_response(response):
+    """HTML・JSONの応答を Accept-Encoding に合わせて brotli・gzip で圧縮する
+
+    ストリーミング（エクスポート・SSE）や圧縮済みの応答、静的ファイル、
+    COMPRESS_MIN_BYTES 未満の応答はそのまま送る。
+    """
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    # 圧縮するかどうかはリクエストごとに変わるため、キャッシュには Accept-Encoding ごとに分けて保存させる
+    response.vary.add('Accept-Encoding')
+    if (request.method == 'HEAD' or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    encoding = choose_content_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    response.set_data(compressed_cache.get((encoding, digest), None, lambda: compress_body(data, encoding)))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(compressed_etag(etag, encoding), weak)
+    return response
+
+# 内容のハッシュ付きURLの静的ファイルをブラウザにキャッシュさせる秒数（内容が変わるとURLも変わる）
+STATIC_MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+# ファイル名ごとの（更新日時, 内容のハッシュ）（更新日時が変わったときだけ計算し直す）
+_static_fingerprints = {}
+
+def static_fingerprint(filename):
+    """静的ファイルの内容のハッシュ（先頭12文字）"""
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _static_fingerprints.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_fingerprints[filename] = (mtime, fingerprint)
+    return fingerprint
+
+@app.template_global()
+def static_url(filename):
+    """テンプレート用: 内容のハッシュ（?v=）付きの静的ファイルのURL"""
+    return url_for('static', filename=filename, v=static_fingerprint(filename))
+
+@app.after_request
+def cache_fingerprinted_static(response):
+    """現在の内容のハッシュ付きURLで取得された静的ファイルは、1年間再検証せずに使わせる"""
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    fingerprint = request.args.get('v')
+    try:
+        current = static_fingerprint(request.view_args['filename'])
+    except (OSError, KeyError):
+        return response
+    # ハッシュがない・古いURLでは、これまで通り毎回再検証させる
+    if fingerprint == current:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE_SECONDS}, immutable'
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus形式のメトリクス（gunicornでは全ワーカーの合計）"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+class HealthProber:
+    """DB・スケジューラーの状態の確認結果を ttl 秒間キャッシュする
+
+    期限の切れた結果を返すときはバックグラウンドスレッドで確認し直すため、
+    ヘルスチェックへのリクエストは確認を待たない。結果がない場合と
+    max_age 秒より古い場合だけ、その場で確認する。
+    probes は名前と (確認する関数, 失敗したら準備未完了とするか) の辞書。
+    """
+
+    def __init__(self, probes, ttl=10.0, max_age=60.0):
+        self.probes = probes
+        self.ttl = ttl
+        self.max_age = max_age
+        self._result = None
+        self._checked_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def report(self):
+        """最新の確認結果（status, ready, checks など）を返す"""
+        with self._lock:
+            age = None if self._checked_at is None else time.monotonic() - self._checked_at
+            if age is not None and age > self.ttl and age <= self.max_age and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, name='health-prober', daemon=True).start()
+        if age is None or age > self.max_age:
+            self.refresh()
+        with self._lock:
+            return dict(self._result, age_seconds=round(time.monotonic() - self._checked_at, 3))
+
+    def refresh(self):
+        checks = {}
+        ready = True
+        degraded = False
+        for name, (probe, critical) in self.probes.items():
+            started = time.perf_counter()
+            try:
+                check = probe()
+            except Exception as e:
+                check = {'status': 'error', 'error': str(e)}
+            check['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            checks[name] = check
+            if check['status'] != 'ok':
+                if critical:
+                    ready = False
+                else:
+                    degraded = True
+        result = {
+            'status': 'error' if not ready else 'degraded' if degraded else 'ok',
+            'ready': ready,
+            'pid': os.getpid(),
+            'checked_at': get_jst_datetime().isoformat(timespec='seconds'),
+            'checks': checks,
+        }
+        with self._lock:
+            self._result = result
+            self._checked_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('ヘルスチェックでエラーが発生しました')
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+def probe_engine(engine):
+    """接続プールから接続を借りて SELECT 1 を実行する"""
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1')).scalar()
+    return {'status': 'ok', 'pool': engine.pool.status()}
+
+def probe_database():
+    with app.app_context():
+        return probe_engine(db.engine)
+
+def probe_archive_database():
+    with app.app_context():
+        return probe_engine(db.engines['archive'])
+
+def probe_scheduler():
+    """リーダーが選ばれていて、このプロセスがリーダーならジョブが予定されているか"""
+    leader_elected = scheduler_leader_lock.locked()
+    is_leader = scheduler_leader_lock.held
+    running = scheduler is not None and scheduler.running
+    now = get_jst_datetime()
+    jobs = {}
+    for job_id, name, func, cron in SCHEDULED_JOBS:
+        if running:
+            job = scheduler.get_job(job_id)
+            next_run_time = job.next_run_time if job else None
+        else:
+            # リーダー以外のプロセスではスケジューラーが動いていないため、トリガーから計算する
+            next_run_time = build_job_trigger(cron).get_next_fire_time(None, now)
+        jobs[job_id] = {
+            'name': name,
+            'next_run_time': next_run_time.isoformat() if next_run_time else None
+        }
+    healthy = leader_elected and (not is_leader or (
+        running and all(job['next_run_time'] for job in jobs.values())
+    ))
+    return {
+        'status': 'ok' if healthy else 'error',
+        'leader_elected': leader_elected,
+        'is_leader': is_leader,
+        'running': running,
+        'jobs': jobs,
+    }
+
+# ヘルスチェックの結果を再利用する秒数（UptimeRobotなどからの頻繁なアクセスでもDBには確認しに行かない）
+HEALTH_CHECK_TTL_SECONDS = float(os.environ.get('HEALTH_CHECK_TTL_SECONDS', '10'))
+
+health_prober = HealthProber(
+    {
+        'database': (probe_database, True),
+        'archive_database': (probe_archive_database, False),
+        'scheduler': (probe_scheduler, False),
+    },
+    ttl=HEALTH_CHECK_TTL_SECONDS,
+    max_age=max(60.0, HEALTH_CHECK_TTL_SECONDS * 6)
+)
 
 @app.route('/ping', methods=['GET', 'HEAD'])
+@app.route('/health/live', methods=['GET', 'HEAD'])
 def ping():
     """シンプルなヘルスチェックエンドポイント（データベース不要）"""
     return 'pong', 200
 
 @app.route('/health', methods=['GET', 'HEAD'])
 def health_check():
-    """UPTIMEROBOT用のヘルスチェックエンドポイント"""
-    try:
-        # データベースファイルの存在確認
-        import os
-        db_path = 'instance/reservations.db'
-        if not os.path.exists(db_path):
-            print("データベースファイルが存在しません")
-            return 'Database File Missing', 500
-        
-        # データベース接続をテスト（タイムアウト付き）
-        import sqlite3
-        with sqlite3.connect(db_path, timeout=5.0) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT 1')
-            result = cursor.fetchone()
-            if result and result[0] == 1:
-                return 'OK', 200
-            else:
-                return 'Database Query Failed', 500
-                
-    except sqlite3.OperationalError as e:
-        print(f"データベース操作エラー: {e}")
-        return 'Database Operational Error', 500
-    except Exception as e:
-        print(f"ヘルスチェックエラー: {e}")
-        return 'Health Check Error', 500
+    """UPTIMEROBOT・Render用のヘルスチェックエンドポイント（DBに接続できれば準備完了）"""
+    report = health_prober.report()
+    if report['ready']:
+        return 'OK', 200
+    return 'Database Unavailable', 503
+
+@app.route('/health/details')
+def health_details():
+    """ヘルスチェックの詳細（DB・アーカイブDB・スケジューラーの状態）"""
+    report = health_prober.report()
+    response = jsonify(report)
+    response.status_code = 200 if report['ready'] else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/', methods=['GET', 'HEAD'])
 def index():
@@ -240,221 +1631,530 @@ def index():
         if request.method == 'HEAD':
             return '', 200
         
-        today = get_jst_date()
+        window = get_date_window()
+        today = window.today
         year = today.year
         month = today.month
-        cal = calendar.monthcalendar(year, month)
-        month_names = ['1月', '2月', '3月', '4月', '5月', '6月', 
-                      '7月', '8月', '9月', '10月', '11月', '12月']
-        # 今月の残り日数を計算
-        import calendar as calmod
-        last_day = calmod.monthrange(year, month)[1]
-        days_left = last_day - today.day
-        calendars = [
-            {
-                'year': year,
-                'month': month,
-                'month_name': month_names[month-1],
-                'calendar': cal
-            }
-        ]
-        # 残り2週間以内なら来月分も追加
-        if days_left < 14:
-            next_month = month + 1
-            next_year = year
-            if next_month > 12:
-                next_month = 1
-                next_year += 1
-            next_cal = calendar.monthcalendar(next_year, next_month)
-            calendars.append({
-                'year': next_year,
-                'month': next_month,
-                'month_name': month_names[next_month-1],
-                'calendar': next_cal
-            })
-        # 今日を含む週の日曜日を計算
-        days_since_sunday = today.weekday() + 1  # 月曜日=0なので+1して日曜日=0にする
-        if days_since_sunday == 7:  # 日曜日の場合は0にする
-            days_since_sunday = 0
-        current_week_sunday = today - timedelta(days=days_since_sunday)
-        
         # 2週間分の日曜日から土曜日まで（14日間）
-        valid_dates = set()
-        for week in range(2):  # 2週間
-            week_start = current_week_sunday + timedelta(weeks=week)
-            for day in range(7):  # 日曜日から土曜日まで
-                current_date = week_start + timedelta(days=day)
-                valid_dates.add(f"{current_date.year}-{current_date.month}-{current_date.day}")
-
-        
-        # DBから予約データ取得
-        practice_requests = {}
-        booked_dates = set()
-        try:
-            all_requests = PracticeRequest.query.all()
-            for req in all_requests:
-                if req.date_key not in practice_requests:
-                    practice_requests[req.date_key] = {}
-                practice_requests[req.date_key][req.user_name] = {
-                    'time_slot': req.time_slot,
-                    'band_name': req.band_name
-                }
-                booked_dates.add(req.date_key)
-        except Exception as e:
-            print(f"予約データ取得でエラー: {e}")
-            practice_requests = {}
-            booked_dates = set()
-            
-        # DBから時間枠取得
-        time_slots = {}
+        valid_dates = window.valid_dates
         try:
-            all_slots = TimeSlot.query.all()
-            for slot in all_slots:
-                if slot.date_key not in time_slots:
-                    time_slots[slot.date_key] = []
-                time_slots[slot.date_key].append(slot.slot)
-        except Exception as e:
-            print(f"時間枠データ取得でエラー: {e}")
-            time_slots = {}
+            version = get_data_version()
+        except Exception:
+            # DBに一時的に接続できない場合も、時間枠・予約なしのカレンダーは表示する
+            logger.exception('データバージョン取得でエラー')
+            db.session.rollback()
+            version = None
+
+        def month_context(calinfo, calendar_data):
+            return {
+                'calinfo': calinfo,
+                'today': today,
+                # 時間枠は選択可能な2週間分のみ表示する
+                'time_slots': calendar_data['time_slots'],
+                'valid_dates': valid_dates,
+                'booked_dates': calendar_data['booked_dates']
+            }
 
+        def load_month_context(calinfo):
+            # 表示範囲の予約データ・時間枠を取得（データが更新されるまではキャッシュから）
+            # 予約の有無だけを使うため、予約者は読み込まない
+            calendar_data = get_calendar_snapshot(window.calendar_start, window.calendar_end, version,
+                                                  include_users=False)
+            return month_context(calinfo, calendar_data)
+
+        def empty_month(calinfo):
+            empty = {'time_slots': {}, 'booked_dates': set()}
+            return Markup(render_template('_calendar_month.html', **month_context(calinfo, empty)))
+
+        def month_fragment(calinfo):
+            if version is None:
+                return empty_month(calinfo)
+            # 月ごとに描画済みのカレンダーを使い回す
+            try:
+                return render_cached_fragment(
+                    ('index_month', today, calinfo['year'], calinfo['month']),
+                    version,
+                    '_calendar_month.html',
+                    lambda: load_month_context(calinfo)
+                )
+            except Exception:
+                # 取得に失敗した場合は時間枠・予約なしで表示する（一時的な失敗をキャッシュに残さない）
+                logger.exception('予約データ取得でエラー')
+                db.session.rollback()
+                return empty_month(calinfo)
+
+        calendar_fragments = [month_fragment(calinfo) for calinfo in window.calendars]
         
         return render_template(
             'index.html',
-            calendars=calendars,
-            month=month_names[month-1],
+            calendar_fragments=calendar_fragments,
+            month=MONTH_NAMES[month-1],
             month_num=month,
             year=year,
-            today=today,
-            practice_requests=practice_requests,
-            time_slots=time_slots,
-            get_default_slots=get_default_slots,
-            valid_dates=valid_dates,
-            booked_dates=booked_dates
+            today=today
         )
     except Exception as e:
-        print(f"index関数でエラーが発生しました: {e}")
+        logger.exception('index関数でエラーが発生しました')
         return f"エラーが発生しました: {str(e)}", 500
 
 @app.route('/admin')
 def admin():
-    today = get_jst_date()
-    # 今日を含む週の日曜日を計算
-    days_since_sunday = today.weekday() + 1  # 月曜日=0なので+1して日曜日=0にする
-    if days_since_sunday == 7:  # 日曜日の場合は0にする
-        days_since_sunday = 0
-    current_week_sunday = today - timedelta(days=days_since_sunday)
-    
-    # 3週間分の日曜日から土曜日まで（21日間）
-    week_dates = []
-    week_labels = ['今週', '来週', '再来週']
-    for week in range(3):  # 3週間
-        week_start = current_week_sunday + timedelta(weeks=week)
-        for day in range(7):  # 日曜日から土曜日まで
-            current_date = week_start + timedelta(days=day)
-            # 日付オブジェクトに週ラベル情報を辞書として追加
-            date_info = {
-                'date': current_date,
-                'week_label': week_labels[week] if day == 0 else None
-            }
-            week_dates.append(date_info)
-    practice_users = {}
+    window = get_date_window()
+    version = get_data_version()
 
-    # DBから時間枠取得
-    time_slots = {}
-    all_slots = TimeSlot.query.all()
-    for slot in all_slots:
-        if slot.date_key not in time_slots:
-            time_slots[slot.date_key] = []
-        time_slots[slot.date_key].append(slot.slot)
-    
-    # 一時保存された時間帯変更を取得
-    pending_changes = {}
-    all_changes = TimeSlotChange.query.all()
-    for change in all_changes:
-        if change.date_key not in pending_changes:
-            pending_changes[change.date_key] = []
-        # 空のマーカーの場合は空のリストとして処理
-        if change.slot == '__EMPTY_SLOTS__':
-            pending_changes[change.date_key] = []
-        else:
-            pending_changes[change.date_key].append(change.slot)
+    # 表示する3週間分の時間枠・一時保存された変更・予約をまとめて取得（データが更新されるまではキャッシュから）
+    calendar_data = get_calendar_snapshot(window.admin_start, window.admin_end, version, include_pending=True)
+    pending_changes = calendar_data['pending_changes']
 
-    for d_info in week_dates:
-        d = d_info['date']  # 実際の日付オブジェクトを取得
-        date_key = f"{d.year}-{d.month}-{d.day}"
-        slots = time_slots.get(date_key, [])
-        users_per_slot = {slot: [] for slot in slots}
-        
-        # DBからこの日付の予約を取得
-        requests = PracticeRequest.query.filter_by(date_key=date_key).all()
-        for req in requests:
-            if req.time_slot in users_per_slot:
-                # 予約者名とバンド名を含むオブジェクトを作成
-                user_info = {
-                    'name': req.user_name,
-                    'band_name': req.band_name
-                }
-                users_per_slot[req.time_slot].append(user_info)
+    def week_context(week_dates):
+        return {
+            'week_dates': week_dates,
+            'time_slots': calendar_data['time_slots'],
+            'practice_users': calendar_data['practice_users'],
+            'pending_changes': pending_changes
+        }
 
-        
-        practice_users[date_key] = users_per_slot
+    # 今週の日曜日から3週間分（21日間）を週ごとに描画済みのブロックで組み立てる
+    week_fragments = []
+    for offset in range(0, len(window.week_dates), 7):
+        week_dates = window.week_dates[offset:offset + 7]
+        week_fragments.append(render_cached_fragment(
+            ('admin_week', window.today, week_dates[0]['date']),
+            version,
+            '_admin_week.html',
+            lambda week_dates=week_dates: week_context(week_dates)
+        ))
     
-    # 次回反映予定時刻を計算（日本時間）
-    next_sunday = current_week_sunday + timedelta(weeks=1)
-    next_update_time = JST.localize(datetime.combine(next_sunday, datetime.min.time().replace(hour=19, minute=0)))
+    # 次回反映予定時刻（日本時間）
+    next_update_time = window.next_update_time
     
     return render_template('admin.html', 
-                         week_dates=week_dates, 
-                         time_slots=time_slots, 
-                         practice_users=practice_users, 
-                         get_default_slots=get_default_slots,
+                         week_fragments=week_fragments, 
                          pending_changes=pending_changes,
-                         next_update_time=next_update_time)
+                         next_update_time=next_update_time,
+                         export_start=window.admin_start,
+                         export_end=window.admin_end,
+                         generate_start=window.admin_start,
+                         generate_end=window.top_up_dates[-1])
+
+@app.route('/admin/cache_stats')
+def cache_stats():
+    """カレンダーデータ・HTML断片・圧縮した本文のキャッシュのヒット数・ミス数を返す"""
+    return jsonify({
+        'calendar': calendar_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'compressed': compressed_cache.stats()
+    })
+
+# エクスポートでDBから一度に読み込む行数（メモリ使用量はこの行数分で一定になる）
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ['date', 'weekday', 'time_slot', 'slot_exists', 'user_name', 'band_name']
+WEEKDAY_NAMES = ['月', '火', '水', '木', '金', '土', '日']
+
+def reservation_export_query(start_date, end_date):
+    """期間内の予約と、その時間枠が現在も存在するかを日付・名前順に取得するSELECT文
+
+    (date, user_name) の一意インデックスの順に読むため、SQLite側でも並べ替えは発生しない。
+    """
+    slot_exists = db.exists().where(
+        TimeSlot.date == PracticeRequest.date,
+        TimeSlot.slot == PracticeRequest.time_slot
+    )
+    return (
+        db.select(
+            PracticeRequest.date,
+            PracticeRequest.time_slot,
+            slot_exists.label('slot_exists'),
+            PracticeRequest.user_name,
+            PracticeRequest.band_name
+        )
+        .where(PracticeRequest.date.between(start_date, end_date))
+        .order_by(PracticeRequest.date, PracticeRequest.user_name)
+    )
+
+def export_record(row):
+    return {
+        'date': row.date.isoformat(),
+        'weekday': WEEKDAY_NAMES[row.date.weekday()],
+        'time_slot': row.time_slot,
+        'slot_exists': bool(row.slot_exists),
+        'user_name': row.user_name,
+        'band_name': row.band_name
+    }
+
+# Excelで数式として解釈される先頭の文字（利用者の入力をそのまま書き出すとCSVインジェクションになる）
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_cell(value):
+    """CSVに書き出す1セルの値（真偽値は0/1、数式として解釈される文字列は先頭に ' を付ける）"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def format_csv_rows(records, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        # Excelで文字化けしないようにBOMを付ける
+        buffer.write('\ufeff')
+        writer.writerow(EXPORT_COLUMNS)
+    for record in records:
+        writer.writerow([csv_cell(record[column]) for column in EXPORT_COLUMNS])
+    return buffer.getvalue()
+
+def format_ndjson_rows(records, header=False):
+    return ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', format_csv_rows),
+    'ndjson': ('application/x-ndjson; charset=utf-8', format_ndjson_rows)
+}
+
+def stream_reservation_export(engine, stmt, formatter):
+    """予約を EXPORT_BATCH_SIZE 行ずつ読み込んで整形したバイト列を順に返す"""
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=EXPORT_BATCH_SIZE).execute(stmt)
+        header = formatter([], header=True)
+        if header:
+            yield header.encode('utf-8')
+        for rows in result.partitions():
+            yield formatter(export_record(row) for row in rows).encode('utf-8')
+
+def gzip_stream(chunks):
+    """バイト列のストリームをその場でgzip圧縮する"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.route('/admin/export_reservations')
+def export_reservations():
+    """期間内の予約をCSV・NDJSONでストリーミング出力する（件数によらずメモリ使用量は一定）
+
+    クエリ: format=csv|ndjson, start=YYYY-MM-DD, end=YYYY-MM-DD（省略時は管理画面の3週間）
+    Accept-Encoding に gzip があれば圧縮しながら送る。
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': '形式は csv または ndjson を指定してください'}), 400
+    window = get_date_window()
+    try:
+        start_date = date.fromisoformat(request.args['start']) if request.args.get('start') else window.admin_start
+        end_date = date.fromisoformat(request.args['end']) if request.args.get('end') else window.admin_end
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    if start_date > end_date:
+        return jsonify({'status': 'error', 'message': '開始日が終了日より後になっています'}), 400
+
+    content_type, formatter = EXPORT_FORMATS[export_format]
+    # 応答の送信中はリクエストのコンテキストがないため、エンジンを先に取り出しておく
+    chunks = stream_reservation_export(db.engine, reservation_export_query(start_date, end_date), formatter)
+    headers = {
+        'Content-Disposition': f'attachment; filename="reservations_{start_date}_{end_date}.{export_format}"',
+        'Cache-Control': 'no-store',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.accept_encodings:
+        chunks = gzip_stream(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, content_type=content_type, headers=headers)
+
+def build_slot_payload(calendar_data, date_key):
+    """1日分の時間枠と予約者リスト・予約数・定員（無制限なら None）をAPI用のリストに変換"""
+    slots = calendar_data['time_slots'].get(date_key, [])
+    # デフォルト時間帯のフォールバックを削除 - 空の場合は空のまま返す
+    slot_users = calendar_data['practice_users'].get(date_key, {})
+    occupancy = calendar_data['occupancy'].get(date_key, {})
+    payload = []
+    for slot in slots:
+        count, capacity = occupancy.get(slot, (0, SLOT_CAPACITY))
+        payload.append({
+            'id': slot,
+            'label': slot,
+            'users': slot_users[slot],
+            'count': count,
+            'capacity': capacity
+        })
+    return payload
+
+def not_modified_response(etag):
+    """If-None-Match が現在のETagと一致する場合の304レスポンスを返す（一致しなければNone）
+
+    圧縮して送った応答のETag（compressed_etag）も一致として扱う。
+    """
+    for candidate in (etag, compressed_etag(etag, 'br'), compressed_etag(etag, 'gzip')):
+        if candidate in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(candidate)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+    return None
+
+def etag_json_response(payload, etag):
+    """ETag付きのJSONレスポンスを作成（ブラウザには毎回再検証させる）"""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/get_time_slots/<int:year>/<int:month>/<int:day>')
 def get_time_slots(year, month, day):
-    date_key = f"{year}-{month}-{day}"
-    slots = [s.slot for s in TimeSlot.query.filter_by(date_key=date_key).all()]
-    # デフォルト時間帯のフォールバックを削除 - 空の場合は空のまま返す
+    try:
+        target_date = date(year, month, day)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    date_key = make_date_key(target_date)
 
-    slot_users = {slot: [] for slot in slots}
-    requests = PracticeRequest.query.filter_by(date_key=date_key).all()
-    for req in requests:
-        if req.time_slot in slot_users:
-            # 予約者名とバンド名を含むオブジェクトを作成
-            user_info = {
-                'name': req.user_name,
-                'band_name': req.band_name
-            }
-            slot_users[req.time_slot].append(user_info)
+    # 応答内容はデータバージョンと日付だけで決まるため、それをETagにする
+    version = get_data_version()
+    etag = f"v{version}-{target_date.isoformat()}"
+    not_modified = not_modified_response(etag)
+    if not_modified is not None:
+        return not_modified
 
-    return jsonify({
-        'time_slots': [
-            {'id': slot, 'label': slot, 'users': slot_users[slot]} for slot in slots
-        ],
+    # トップページ・受付期間の表示期間内であれば、その期間のキャッシュから返す
+    window = get_date_window()
+    if window.display_start <= target_date <= window.display_end:
+        calendar_data = get_calendar_snapshot(window.display_start, window.display_end, version)
+    else:
+        calendar_data = load_calendar_data(target_date, target_date)
+
+    return etag_json_response({
+        'time_slots': build_slot_payload(calendar_data, date_key),
         'selected': None
-    })
+    }, etag)
+
+@app.route('/get_time_slots_range')
+def get_time_slots_range():
+    """選択可能な2週間分の時間枠と予約者を1回のレスポンスで返す"""
+    window = get_date_window()
+
+    version = get_data_version()
+    etag = f"v{version}-{window.selectable_start.isoformat()}-{window.selectable_end.isoformat()}"
+    not_modified = not_modified_response(etag)
+    if not_modified is not None:
+        return not_modified
+
+    # /get_time_slots と同じ期間のキャッシュを使う（今週の日曜日が前月でも2週間分を含む）
+    calendar_data = get_calendar_snapshot(window.display_start, window.display_end, version)
+
+    dates = {}
+    for selectable_date in window.selectable_dates:
+        date_key = make_date_key(selectable_date)
+        dates[date_key] = build_slot_payload(calendar_data, date_key)
+
+    return etag_json_response({
+        'start': window.selectable_start.isoformat(),
+        'end': window.selectable_end.isoformat(),
+        'dates': dates
+    }, etag)
+
+# SSE接続の上限（1プロセスあたり）とキープアライブ・再接続までの間隔
+SSE_MAX_SUBSCRIBERS = 200
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_STREAM_SECONDS = 600
+
+def serves_streams_cooperatively():
+    """長時間のSSE接続を受け付けても他のリクエストが止まらない実行環境か"""
+    # gunicorn の sync ワーカーは1接続でワーカー1つを占有する（開発用サーバーはスレッドで処理する）
+    return COOPERATIVE_WORKER or 'gunicorn' not in sys.modules
+
+@app.route('/slot_events')
+def slot_events():
+    """時間枠・予約が変わった日付の差分を Server-Sent Events で配信する
+
+    接続ごとにワーカーを占有しないよう、gevent ワーカーで動かす前提（gunicorn.conf.py）。
+    一定時間で接続を閉じ、クライアント（EventSource）の自動再接続で張り直させる。
+    """
+    if not serves_streams_cooperatively():
+        # 204はEventSourceに再接続をやめさせる（画面は従来どおり取得時の内容で動く）
+        return Response(status=204)
+    if slot_event_broker.subscriber_count >= SSE_MAX_SUBSCRIBERS:
+        return jsonify({'status': 'error', 'message': '接続数が上限に達しています'}), 503
+    subscriber = slot_event_broker.subscribe()
+
+    def stream():
+        try:
+            yield f"retry: {SSE_KEEPALIVE_SECONDS * 1000}\n\n"
+            deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if message is None:
+                    break
+                yield f"data: {json.dumps(message, ensure_ascii=False, separators=(',', ':'))}\n\n"
+        finally:
+            slot_event_broker.unsubscribe(subscriber)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # リバースプロキシでバッファリングさせない
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def practice_request_upsert():
+    """同じ日・同じ名前の予約があれば時間帯とバンド名を上書きするINSERT文（1文で原子的に行う）"""
+    stmt = upsert_insert(PracticeRequest)
+    return stmt.on_conflict_do_update(
+        index_elements=['date', 'user_name'],
+        set_={'band_name': stmt.excluded.band_name, 'time_slot': stmt.excluded.time_slot}
+    )
 
 @app.route('/submit_practice', methods=['POST'])
 def submit_practice():
     data = request.get_json()
-    print(f"練習希望送信: {data}")  # デバッグ用
-    date_key = f"{data['year']}-{data['month']}-{data['day']}"
+    logger.debug('練習希望送信', extra={'payload': data})
+    try:
+        target_date = date(int(data['year']), int(data['month']), int(data['day']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
     user_name = data.get('user_name')
     band_name = data.get('band_name')  # バンド名を取得
     time_slot = data.get('time_slot')
     if not user_name or not band_name or not time_slot:
         return jsonify({'status': 'error', 'message': '名前、バンド名、時間帯は必須です'}), 400
-    existing = PracticeRequest.query.filter_by(date_key=date_key, user_name=user_name).first()
-    if existing:
-        existing.time_slot = time_slot
-        existing.band_name = band_name  # バンド名も更新
-    else:
-        db.session.add(PracticeRequest(date_key=date_key, user_name=user_name, band_name=band_name, time_slot=time_slot))
 
-    db.session.commit()
+    def save():
+        # 先に書き込みを行って書き込みロックを取り、変更前の時間帯の確認から登録までの間に他の書き込みを挟ませない
+        bump_data_version()
+        previous_slot = db.session.execute(
+            db.select(PracticeRequest.time_slot)
+            .where(PracticeRequest.date == target_date, PracticeRequest.user_name == user_name)
+        ).scalar()
+        if previous_slot != time_slot:
+            if not increment_slot_occupancy(target_date, time_slot):
+                db.session.rollback()
+                return False
+            if previous_slot is not None:
+                decrement_slot_occupancy(target_date, previous_slot)
+        db.session.execute(practice_request_upsert(), {
+            'date': target_date,
+            'user_name': user_name,
+            'band_name': band_name,
+            'time_slot': time_slot
+        })
+        record_slot_events([target_date])
+        db.session.commit()
+        return True
+
+    if not run_with_busy_retry(save):
+        return jsonify({'status': 'error', 'message': 'この時間帯は定員に達しています'}), 409
     return jsonify({'status': 'success'})
 
+BATCH_MAX_ENTRIES = 31
+
+@app.route('/submit_practice_batch', methods=['POST'])
+def submit_practice_batch():
+    """複数日の練習希望を1回のリクエスト・1トランザクションでまとめて登録"""
+    data = request.get_json(silent=True) or {}
+    user_name = data.get('user_name')
+    default_band_name = data.get('band_name')
+    entries = data.get('entries')
+    if not user_name or not isinstance(entries, list) or not entries:
+        return jsonify({'status': 'error', 'message': '名前と登録する日付は必須です'}), 400
+    if len(entries) > BATCH_MAX_ENTRIES:
+        return jsonify({'status': 'error', 'message': f'一度に登録できるのは{BATCH_MAX_ENTRIES}件までです'}), 400
+
+    # 受付期間（今週の日曜日から2週間）
+    window = get_date_window()
+    window_start = window.selectable_start
+    window_end = window.selectable_end
+
+    # 受付期間内の時間枠を1クエリで取得して検証に使う
+    slots_by_date = {}
+    for row in db.session.execute(
+        db.select(TimeSlot.date, TimeSlot.slot).where(TimeSlot.date.between(window_start, window_end))
+    ):
+        slots_by_date.setdefault(row.date, set()).add(row.slot)
+
+    results = []
+    rows = []
+    row_results = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            results.append({'index': index, 'status': 'error', 'message': '不正なデータ'})
+            continue
+        try:
+            entry_date = date(int(entry['year']), int(entry['month']), int(entry['day']))
+        except (KeyError, TypeError, ValueError):
+            results.append({'index': index, 'status': 'error', 'message': '不正な日付です'})
+            continue
+        result = {'index': index, 'date': make_date_key(entry_date)}
+        band_name = entry.get('band_name') or default_band_name
+        time_slot = entry.get('time_slot')
+        if not band_name or not time_slot:
+            result.update(status='error', message='バンド名と時間帯は必須です')
+        elif not window_start <= entry_date <= window_end:
+            result.update(status='error', message='受付期間外の日付です')
+        elif time_slot not in slots_by_date.get(entry_date, ()):
+            result.update(status='error', message='存在しない時間帯です')
+        else:
+            result['status'] = 'success'
+            rows.append({
+                'date': entry_date,
+                'user_name': user_name,
+                'band_name': band_name,
+                'time_slot': time_slot
+            })
+            row_results.append(result)
+        results.append(result)
+
+    saved = 0
+    if rows:
+        def save():
+            """登録した件数と、定員に達していて登録できなかった行の位置を返す"""
+            bump_data_version()
+            slots_by_date = dict(db.session.execute(
+                db.select(PracticeRequest.date, PracticeRequest.time_slot).where(
+                    PracticeRequest.user_name == user_name,
+                    PracticeRequest.date.in_({row['date'] for row in rows})
+                )
+            ).all())
+            accepted = []
+            full = []
+            for position, row in enumerate(rows):
+                previous_slot = slots_by_date.get(row['date'])
+                if previous_slot != row['time_slot']:
+                    if not increment_slot_occupancy(row['date'], row['time_slot']):
+                        full.append(position)
+                        continue
+                    if previous_slot is not None:
+                        decrement_slot_occupancy(row['date'], previous_slot)
+                    slots_by_date[row['date']] = row['time_slot']
+                accepted.append(row)
+            if not accepted:
+                db.session.rollback()
+                return 0, full
+            db.session.execute(practice_request_upsert(), accepted)
+            record_slot_events(row['date'] for row in accepted)
+            db.session.commit()
+            return len(accepted), full
+
+        saved, full = run_with_busy_retry(save)
+        for position in full:
+            row_results[position].update(status='error', message='この時間帯は定員に達しています')
+
+    if saved == len(entries):
+        status, code = 'success', 200
+    elif saved:
+        status, code = 'partial', 200
+    elif rows:
+        status, code = 'error', 409
+    else:
+        status, code = 'error', 400
+    return jsonify({
+        'status': status,
+        'message': f'{saved}件の練習希望を登録しました',
+        'results': results
+    }), code
+
 @app.route('/admin/update_time_slots', methods=['POST'])
 def update_time_slots():
     data = request.get_json()
@@ -462,20 +2162,23 @@ def update_time_slots():
     slots = data.get('slots', [])
     if not date_str or not isinstance(slots, list):
         return jsonify({'status': 'error', 'message': '不正なデータ'}), 400
-    # ゼロ埋めなしのキーに変換
-    y, m, d = [int(x) for x in date_str.split('-')]
-    key = f'{y}-{m}-{d}'
+    try:
+        target_date = parse_date_key(date_str)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正なデータ'}), 400
     
+    # 先に書き込みロックを取り、反映中の apply_pending_time_slot_changes と入れ違いにならないようにする
+    bump_data_version()
     # 既存の一時保存データを削除
-    TimeSlotChange.query.filter_by(date_key=key).delete()
+    TimeSlotChange.query.filter_by(date=target_date).delete()
     
     # 新しい時間帯を一時保存（空の配列の場合も処理）
     if slots:
         for slot in slots:
-            db.session.add(TimeSlotChange(date_key=key, slot=slot))
+            db.session.add(TimeSlotChange(date=target_date, slot=slot))
     else:
         # 空の配列の場合、特別なマーカーを保存して削除予定であることを記録
-        db.session.add(TimeSlotChange(date_key=key, slot='__EMPTY_SLOTS__'))
+        db.session.add(TimeSlotChange(date=target_date, slot=EMPTY_SLOTS_MARKER))
 
     db.session.commit()
     return jsonify({'status': 'success', 'message': '時間帯変更を一時保存しました。毎週日曜日19:00に反映されます。'})
@@ -484,76 +2187,34 @@ def update_time_slots():
 def apply_changes_now():
     """管理者による即時更新"""
     try:
-        # 時間帯変更の一時保存データを取得
-        changes = TimeSlotChange.query.all()
+        report = apply_pending_time_slot_changes()
         
-        if not changes:
+        if not report['change_count']:
             return jsonify({'status': 'info', 'message': '反映する変更がありません。'})
         
-        # 日付ごとにグループ化
-        changes_by_date = {}
-        for change in changes:
-            if change.date_key not in changes_by_date:
-                changes_by_date[change.date_key] = []
-            changes_by_date[change.date_key].append(change.slot)
-        
-        # 各日付の時間帯を更新
-        for date_key, slots in changes_by_date.items():
-            # 既存の時間帯を削除
-            TimeSlot.query.filter_by(date_key=date_key).delete()
-            
-            # 新しい時間帯を追加（空のマーカーがある場合は何も追加しない）
-            for slot in slots:
-                if slot != '__EMPTY_SLOTS__':
-                    db.session.add(TimeSlot(date_key=date_key, slot=slot))
-        
-        # 一時保存データを削除
-        TimeSlotChange.query.delete()
-        
-        db.session.commit()
-        
-        print(f"管理者による即時更新: {len(changes)}件の変更を反映しました")
+        logger.info('管理者による即時更新', extra={'change_count': report['change_count']})
         return jsonify({
             'status': 'success', 
-            'message': f'{len(changes_by_date)}日分の時間帯変更を即座に反映しました。'
+            'message': f"{len(report['dates'])}日分の時間帯変更を即座に反映しました。",
+            'report': report
         })
         
     except Exception as e:
         db.session.rollback()
-        print(f"即時更新でエラーが発生しました: {e}")
+        logger.exception('即時更新でエラーが発生しました')
         return jsonify({'status': 'error', 'message': f'更新に失敗しました: {str(e)}'}), 500
 
 @app.route('/admin/initialize_default_slots', methods=['POST'])
 def initialize_default_slots():
     """管理者による初期時間帯設定"""
     try:
-        # 今日を含む週の日曜日を計算（日本時間）
-        today = get_jst_date()
-        days_since_sunday = today.weekday() + 1  # 月曜日=0なので+1して日曜日=0にする
-        if days_since_sunday == 7:  # 日曜日の場合は0にする
-            days_since_sunday = 0
-        current_week_sunday = today - timedelta(days=days_since_sunday)
-        
-        # 3週間分の日曜日から土曜日まで（21日間）にデフォルト時間帯を設定
-        count = 0
-        for week in range(3):  # 3週間
-            week_start = current_week_sunday + timedelta(weeks=week)
-            for day in range(7):  # 日曜日から土曜日まで
-                current_date = week_start + timedelta(days=day)
-                date_key = f"{current_date.year}-{current_date.month}-{current_date.day}"
-                
-                # 既存の時間帯がない場合のみデフォルト時間帯を設定
-                existing = TimeSlot.query.filter_by(date_key=date_key).first()
-                if not existing:
-                    default_slots = get_default_slots(current_date.year, current_date.month, current_date.day)
-                    for slot in default_slots:
-                        db.session.add(TimeSlot(date_key=date_key, slot=slot))
-                    count += 1
-        
-        db.session.commit()
+        # 今週の日曜日から3週間分（21日間）のうち、時間枠のない日付にデフォルト時間帯を設定（日本時間）
+        window = get_date_window()
+        plan, _ = generate_time_slots(window.admin_start, window.admin_end)
+        count = len(plan)
         
         if count > 0:
-            print(f"管理者による初期時間帯設定: {count}日分を設定しました")
+            logger.info('管理者による初期時間帯設定', extra={'dates': count})
             return jsonify({
                 'status': 'success', 
                 'message': f'{count}日分のデフォルト時間帯を設定しました。'
@@ -566,59 +2227,362 @@ def initialize_default_slots():
         
     except Exception as e:
         db.session.rollback()
-        print(f"初期時間帯設定でエラーが発生しました: {e}")
+        logger.exception('初期時間帯設定でエラーが発生しました')
         return jsonify({'status': 'error', 'message': f'設定に失敗しました: {str(e)}'}), 500
 
+def parse_generation_range(values):
+    """時間枠を作成する期間（start, end: YYYY-MM-DD）を取得する
+
+    省略時は今週の日曜日から週次の補充の対象の週まで。不正な場合は (None, None, エラーメッセージ) を返す。
+    """
+    window = get_date_window()
+    try:
+        start_date = date.fromisoformat(values['start']) if values.get('start') else window.admin_start
+        end_date = date.fromisoformat(values['end']) if values.get('end') else window.top_up_dates[-1]
+    except (TypeError, ValueError):
+        return None, None, '不正な日付です'
+    if start_date > end_date:
+        return None, None, '開始日が終了日より後になっています'
+    if (end_date - start_date).days >= SLOT_GENERATION_MAX_DAYS:
+        return None, None, f'期間は{SLOT_GENERATION_MAX_DAYS}日以内で指定してください'
+    return start_date, end_date, None
+
+@app.route('/admin/time_slot_plan')
+def preview_time_slots():
+    """規則から作成される時間枠のプレビュー（時間枠のない日付の分だけ。DBには書き込まない）
+
+    クエリ: start=YYYY-MM-DD, end=YYYY-MM-DD（省略時は今週の日曜日から4週間）
+    """
+    start_date, end_date, error = parse_generation_range(request.args)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    plan, skipped = plan_time_slots(start_date, end_date)
+    return jsonify({
+        'status': 'success',
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        **time_slot_plan_report(plan, skipped)
+    })
+
+@app.route('/admin/default_time_slots')
+def default_time_slots():
+    """管理画面の「デフォルト時間帯を設定」用の1日分の規則の時間枠（クエリ: date=YYYY-MM-DD）
+
+    時間帯を空にした日付にも規則の時間帯を入れ直せるよう、既存の時間枠があっても返す。
+    """
+    try:
+        target_date = date.fromisoformat(request.args.get('date', ''))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    return jsonify({
+        'status': 'success',
+        'date': target_date.isoformat(),
+        'slots': rule_slots_for_date(target_date)
+    })
+
+@app.route('/admin/generate_time_slots', methods=['POST'])
+def generate_time_slots_now():
+    """管理者による期間を指定した時間枠の一括作成（学期分など。時間枠のある日付はそのまま）"""
+    data = request.get_json(silent=True) or {}
+    start_date, end_date, error = parse_generation_range(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    try:
+        plan, skipped = generate_time_slots(start_date, end_date)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('時間枠の一括作成でエラーが発生しました')
+        return jsonify({'status': 'error', 'message': f'作成に失敗しました: {str(e)}'}), 500
+    report = time_slot_plan_report(plan, skipped)
+    logger.info('管理者による時間枠の一括作成', extra={
+        'start': start_date.isoformat(), 'end': end_date.isoformat(),
+        'dates': report['date_count'], 'slots': report['slot_count']
+    })
+    return jsonify({
+        'status': 'success',
+        'message': f"{report['date_count']}日分の時間帯を作成しました",
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        **report
+    })
+
+@app.route('/admin/slot_rules', methods=['GET', 'POST'])
+def slot_rules():
+    """時間枠の作成規則と祝日の取得・更新
+
+    POST: {"rules": {"mon": ["16:50〜18:00"], "holiday": [...]}} で指定した曜日の規則を置き換え、
+    {"holidays": {"add": [{"date": "YYYY-MM-DD", "name": "..."}], "remove": ["YYYY-MM-DD"]}} で祝日を追加・削除する。
+    既に作成済みの時間枠は変わらない（これから作成する日付にだけ使われる）。
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        rules = data.get('rules') or {}
+        holidays = data.get('holidays') or {}
+        if not isinstance(rules, dict) or not isinstance(holidays, dict):
+            return jsonify({'status': 'error', 'message': '不正なデータです'}), 400
+        rule_rows = []
+        for name, slots in rules.items():
+            if name not in DAY_TYPE_NAMES:
+                return jsonify({'status': 'error', 'message': f'不正な曜日です: {name}'}), 400
+            if (not isinstance(slots, list) or len(set(slots)) != len(slots) or not all(
+                    isinstance(slot, str) and slot and len(slot) <= 50 and slot != EMPTY_SLOTS_MARKER
+                    for slot in slots)):
+                return jsonify({'status': 'error', 'message': f'不正な時間帯です: {name}'}), 400
+            day_type = DAY_TYPE_NAMES.index(name)
+            rule_rows.extend(
+                {'day_type': day_type, 'slot': slot, 'position': position}
+                for position, slot in enumerate(slots)
+            )
+        try:
+            added_holidays = {
+                date.fromisoformat(item['date']): str(item.get('name') or '')[:100]
+                for item in holidays.get('add') or ()
+            }
+            removed_holidays = {date.fromisoformat(value) for value in holidays.get('remove') or ()}
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': '不正な祝日の日付です'}), 400
+
+        def save():
+            if rules:
+                day_types = [DAY_TYPE_NAMES.index(name) for name in rules]
+                db.session.execute(db.delete(SlotRule).where(SlotRule.day_type.in_(day_types)))
+                if rule_rows:
+                    db.session.execute(db.insert(SlotRule), rule_rows)
+            if removed_holidays or added_holidays:
+                db.session.execute(db.delete(Holiday).where(
+                    Holiday.date.in_(removed_holidays | set(added_holidays))
+                ))
+            if added_holidays:
+                db.session.execute(db.insert(Holiday), [
+                    {'date': holiday, 'name': name} for holiday, name in added_holidays.items()
+                ])
+            db.session.commit()
+
+        run_with_busy_retry(save)
+        logger.info('時間枠の作成規則を更新しました', extra={
+            'day_types': list(rules), 'holidays_added': len(added_holidays), 'holidays_removed': len(removed_holidays)
+        })
+
+    rules = load_slot_rules()
+    return jsonify({
+        'status': 'success',
+        'rules': {name: rules.get(day_type, []) for day_type, name in enumerate(DAY_TYPE_NAMES)},
+        'holidays': [
+            {'date': holiday.date.isoformat(), 'name': holiday.name}
+            for holiday in db.session.execute(db.select(Holiday).order_by(Holiday.date)).scalars()
+        ]
+    })
+
+@app.route('/admin/archive_now', methods=['POST'])
+def archive_now():
+    """管理者による即時アーカイブ"""
+    try:
+        report = run_archival()
+        logger.info('管理者によるアーカイブ', extra=report)
+        return jsonify({'status': 'success', 'report': report})
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('アーカイブでエラーが発生しました')
+        return jsonify({'status': 'error', 'message': f'アーカイブに失敗しました: {str(e)}'}), 500
+
+@app.route('/admin/reconcile_occupancy', methods=['POST'])
+def reconcile_occupancy_now():
+    """管理者による予約数の集計の確認・修正"""
+    try:
+        fixes = reconcile_slot_occupancy()
+        if fixes:
+            logger.warning('予約数の集計のずれを修正しました', extra={'slots': len(fixes), 'fixes': fixes[:20]})
+        return jsonify({'status': 'success', 'fixes': fixes})
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('予約数の確認でエラーが発生しました')
+        return jsonify({'status': 'error', 'message': f'確認に失敗しました: {str(e)}'}), 500
+
+@app.route('/admin/slot_capacity', methods=['POST'])
+def update_slot_capacity():
+    """日付・時間枠ごとの定員を設定する（capacity を null にすると既定の SLOT_CAPACITY に戻す）
+
+    既に定員を超えている予約はそのまま残り、新しい予約だけを受け付けなくなる。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        target_date = date(int(data['year']), int(data['month']), int(data['day']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    time_slot = data.get('time_slot')
+    capacity = data.get('capacity')
+    if not time_slot:
+        return jsonify({'status': 'error', 'message': '時間帯は必須です'}), 400
+    if capacity is not None and (isinstance(capacity, bool) or not isinstance(capacity, int) or capacity < 0):
+        return jsonify({'status': 'error', 'message': '定員は0以上の整数で指定してください'}), 400
+
+    def save():
+        stmt = upsert_insert(SlotOccupancy).values(date=target_date, slot=time_slot, count=0, capacity=capacity)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['date', 'slot'],
+            set_={'capacity': stmt.excluded.capacity}
+        ))
+        count = db.session.execute(
+            db.select(SlotOccupancy.count)
+            .where(SlotOccupancy.date == target_date, SlotOccupancy.slot == time_slot)
+        ).scalar()
+        record_slot_events([target_date])
+        bump_data_version()
+        db.session.commit()
+        return count
+
+    count = run_with_busy_retry(save)
+    logger.info('定員を設定しました', extra={'date': make_date_key(target_date), 'time_slot': time_slot,
+                                          'capacity': capacity})
+    return jsonify({'status': 'success', 'count': count, 'capacity': effective_capacity(capacity)})
+
+# アーカイブの閲覧で一度に指定できる期間
+ARCHIVE_QUERY_MAX_DAYS = 366
+
+@app.route('/admin/archive')
+def archived_history():
+    """アーカイブ済みの予約と時間枠を返す
+
+    クエリ: start=YYYY-MM-DD, end=YYYY-MM-DD（省略時はアーカイブ境界の前日までの4週間）, user_name（任意）
+    """
+    default_end = get_archive_cutoff() - timedelta(days=1)
+    try:
+        end_date = date.fromisoformat(request.args['end']) if request.args.get('end') else default_end
+        start_date = (date.fromisoformat(request.args['start']) if request.args.get('start')
+                      else end_date - timedelta(days=ARCHIVE_RETENTION_DAYS - 1))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    if start_date > end_date:
+        return jsonify({'status': 'error', 'message': '開始日が終了日より後になっています'}), 400
+    if (end_date - start_date).days >= ARCHIVE_QUERY_MAX_DAYS:
+        return jsonify({'status': 'error', 'message': f'期間は{ARCHIVE_QUERY_MAX_DAYS}日以内で指定してください'}), 400
+
+    reservations = db.select(ArchivedPracticeRequest).where(
+        ArchivedPracticeRequest.date.between(start_date, end_date)
+    ).order_by(ArchivedPracticeRequest.date, ArchivedPracticeRequest.id)
+    user_name = request.args.get('user_name')
+    if user_name:
+        reservations = reservations.where(ArchivedPracticeRequest.user_name == user_name)
+
+    time_slots = {}
+    for slot in db.session.execute(
+        db.select(ArchivedTimeSlot).where(
+            ArchivedTimeSlot.date.between(start_date, end_date)
+        ).order_by(ArchivedTimeSlot.id)
+    ).scalars():
+        time_slots.setdefault(slot.date.isoformat(), []).append(slot.slot)
+
+    return jsonify({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'time_slots': time_slots,
+        'reservations': [
+            {
+                'date': req.date.isoformat(),
+                'time_slot': req.time_slot,
+                'user_name': req.user_name,
+                'band_name': req.band_name
+            }
+            for req in db.session.execute(reservations).scalars()
+        ]
+    })
+
 @app.route('/cancel_practice', methods=['POST'])
 def cancel_practice():
     """予約キャンセル機能"""
+    data = request.get_json()
     try:
-        data = request.get_json()
-        date_key = f"{data['year']}-{data['month']}-{data['day']}"
+        target_date = date(int(data['year']), int(data['month']), int(data['day']))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': '不正な日付です'}), 400
+    try:
+        date_key = make_date_key(target_date)
         user_name = data.get('user_name')
         time_slot = data.get('time_slot')
         
         if not user_name or not time_slot:
             return jsonify({'status': 'error', 'message': '名前と時間帯は必須です'}), 400
         
-        # 該当する予約を検索して削除
-        reservation = PracticeRequest.query.filter_by(
-            date_key=date_key, 
-            user_name=user_name, 
-            time_slot=time_slot
-        ).first()
+        def delete():
+            # 該当する予約を1文で削除（RETURNING非対応のSQLiteでは削除件数で判定）
+            stmt = db.delete(PracticeRequest).where(
+                PracticeRequest.date == target_date,
+                PracticeRequest.user_name == user_name,
+                PracticeRequest.time_slot == time_slot
+            ).execution_options(synchronize_session=False)
+            if db.engine.dialect.delete_returning:
+                deleted = db.session.execute(stmt.returning(PracticeRequest.id)).first() is not None
+            else:
+                deleted = db.session.execute(stmt).rowcount > 0
+            if not deleted:
+                db.session.rollback()
+                return False
+            decrement_slot_occupancy(target_date, time_slot)
+            record_slot_events([target_date])
+            bump_data_version()
+            db.session.commit()
+            return True
         
-        if not reservation:
+        if not run_with_busy_retry(delete):
             return jsonify({'status': 'error', 'message': '該当する予約が見つかりません'}), 404
         
-        db.session.delete(reservation)
-        db.session.commit()
-        
-        print(f"予約キャンセル: {date_key} {user_name} {time_slot}")
+        logger.info('予約キャンセル', extra={'date': date_key, 'user_name': user_name, 'time_slot': time_slot})
         return jsonify({'status': 'success', 'message': '予約をキャンセルしました'})
         
     except Exception as e:
         db.session.rollback()
-        print(f"予約キャンセルでエラーが発生しました: {e}")
+        logger.exception('予約キャンセルでエラーが発生しました')
         return jsonify({'status': 'error', 'message': f'キャンセルに失敗しました: {str(e)}'}), 500
 
 # アプリケーション終了時のクリーンアップ処理
 import atexit
 
 def cleanup_scheduler():
-    """アプリケーション終了時にスケジューラーを停止"""
+    """アプリケーション終了時にスケジューラーを停止し、リーダーを他のワーカーに譲る"""
     try:
-        if scheduler.running:
+        if scheduler is not None and scheduler.running:
             scheduler.shutdown()
-            print("スケジューラーを正常に停止しました")
-    except Exception as e:
-        print(f"スケジューラーの停止でエラーが発生しました: {e}")
+            logger.info('スケジューラーを正常に停止しました')
+    except Exception:
+        logger.exception('スケジューラーの停止でエラーが発生しました')
+    finally:
+        scheduler_leader_lock.release()
 
 atexit.register(cleanup_scheduler)
 
+_app_initialized = False
+_app_init_lock = threading.Lock()
+
+def create_app():
+    """DBの初期化とスケジューラーのリーダー選出を行い、アプリを返す（gunicorn: app:create_app()）
+
+    import app だけではDBにもスケジューラーにも触れないため、読み込みは軽い。
+    スケジューラーは最初のリクエストを待たせないようバックグラウンドで開始する。
+    2回目以降の呼び出しは何もしない。
+    """
+    global _app_initialized
+    with _app_init_lock:
+        if not _app_initialized:
+            try:
+                initialize_database()
+            except Exception:
+                logger.exception('データベース初期化でエラーが発生しました')
+            threading.Thread(
+                target=run_scheduler_leader_election,
+                name='scheduler-leader-election',
+                daemon=True
+            ).start()
+            _app_initialized = True
+    return app
+
+@app.before_request
+def ensure_app_initialized():
+    # app:app として読み込まれた場合（flask run など）は最初のリクエストで初期化する
+    if not _app_initialized:
+        create_app()
+
 if __name__ == '__main__':
-    import os
     host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') == 'development'
-    app.run(debug=debug, host=host, port=port) 
\ No newline at end of file
+    create_app().run(debug=debug, host=host, port=port) 
\ No newline at end of file
@@ -0,0 +1,190 @@
+"""JSON形式のログ出力（QueueHandler / QueueListener）
+
+ログは呼び出し元ではキューに入れるだけで、標準出力への書き込みは専用のOSスレッドで行う。
+Renderのログの出力先が詰まっても、リクエストを処理するスレッドは待たされない
+（出力待ちが多すぎる場合は破棄して、後で件数をログに出す）。
+
+環境変数:
+    LOG_LEVEL: 全体のレベル（既定 INFO）
+    LOG_LEVELS: モジュールごとのレベル（例: "app=DEBUG,apscheduler=WARNING"）
+    LOG_DEBUG_SAMPLE_RATE: DEBUGのログを残す割合（既定 1.0、例: 0.01 で100件に1件）
+    LOG_QUEUE_MAX: 出力待ちにできるログの件数（既定 10000）
+"""
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import copy
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+
+DEFAULT_MODULE_LEVELS = {
+    # ジョブの開始・終了ごとのINFOは出さない（以前と同じく警告以上だけ）
+    'apscheduler': 'WARNING',
+}
+
+# LogRecord が元から持つ属性（これ以外は extra で渡された項目としてJSONに含める）
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+def gevent_monkey():
+    """gevent が読み込み済みなら gevent.monkey を返す（読み込まれていなければ None）"""
+    # gevent ワーカーでは読み込み済みのため、それ以外では読み込みの時間をかけない
+    if 'gevent' not in sys.modules:
+        return None
+    from gevent import monkey
+    return monkey
+
+
+def _original(module, name):
+    """gevent のモンキーパッチ前の実装を返す（パッチされていなければそのまま）"""
+    monkey = gevent_monkey()
+    if monkey is None:
+        return getattr(importlib.import_module(module), name)
+    return monkey.get_original(module, name)
+
+
+class JsonFormatter(logging.Formatter):
+    """1件のログを1行のJSONにする（extra で渡した項目もそのまま含める）"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """DEBUGのログを rate の割合だけ残す（INFO以上はすべて残す）"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """キューに入れるだけのハンドラー（出力待ちが max_pending 件以上なら破棄する）"""
+
+    def __init__(self, queue, max_pending):
+        super().__init__(queue)
+        self.max_pending = max_pending
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+    def prepare(self, record):
+        # メッセージと例外のトレースバックはここで文字列にし、JSONへの変換は出力用のスレッドで行う
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class NativeThreadQueueListener(QueueListener):
+    """gevent ワーカーでも本物のOSスレッドで出力する QueueListener
+
+    モンキーパッチされたスレッド（greenlet）で書き込むと、出力先が詰まったときに
+    ワーカー全体が止まるため、パッチ前の _thread でスレッドを作る。
+    """
+
+    def __init__(self, queue, handler, source):
+        super().__init__(queue, handler)
+        self.source = source
+        self._reported_drops = 0
+        self._finished = None
+
+    def start(self):
+        self._finished = _original('_thread', 'allocate_lock')()
+        self._finished.acquire()
+        _original('_thread', 'start_new_thread')(self._run, ())
+
+    def _run(self):
+        try:
+            self._monitor()
+        finally:
+            self._finished.release()
+
+    def stop(self, timeout=5):
+        if self._finished is None:
+            return
+        self.enqueue_sentinel()
+        self._finished.acquire(timeout=timeout)
+        self._finished = None
+
+    def handle(self, record):
+        dropped = self.source.dropped
+        if dropped > self._reported_drops:
+            super().handle(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': 'ログの出力が追いつかず破棄しました',
+                'dropped': dropped - self._reported_drops,
+            }))
+            self._reported_drops = dropped
+        super().handle(record)
+
+
+def parse_module_levels(value):
+    """"app=DEBUG,apscheduler=WARNING" をモジュール名とレベルの辞書にする"""
+    levels = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, level = item.split('=', 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """ルートロガーにキュー経由のJSON出力を設定する（プロセスごとに1回だけ）"""
+    global _listener
+    if _listener is not None:
+        return
+
+    queue = _original('queue', 'SimpleQueue')()
+    handler = NonBlockingQueueHandler(queue, int(os.environ.get('LOG_QUEUE_MAX', '10000')))
+    handler.addFilter(DebugSamplingFilter(float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '1.0'))))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    # 出力用のスレッドだけが使うロック（gevent のロックはOSスレッドをまたいで使えない）
+    output.lock = _original('_thread', 'RLock')()
+
+    root = logging.getLogger()
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    root.addHandler(handler)
+    levels = dict(DEFAULT_MODULE_LEVELS, **parse_module_levels(os.environ.get('LOG_LEVELS', '')))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = NativeThreadQueueListener(queue, output, handler)
+    _listener.start()
+    # 終了時に出力待ちのログを書き出す（atexit は登録と逆順に実行されるため、最後に実行される）
+    atexit.register(_listener.stop)
@@ -0,0 +1,156 @@
+"""コールドスタート（プロセスの起動から最初の応答まで）の時間の確認
+
+1. 新しいPythonプロセスで app を読み込み、読み込み・create_app()・最初の GET / にかかる時間を測る
+2. gunicorn（gunicorn.conf.py の設定）を起動してから GET / の応答が返るまでの時間を測る
+
+それぞれ、instance/ が空の状態（初回デプロイ）と、前回の起動で初期化済みのDBがある状態
+（Renderでのスピンダウン後の再起動）で --runs 回ずつ測り、中央値と最小値を表示する。
+--ref に以前のコミットを渡すと、その版と比較できる。
+
+使い方:
+    python benchmarks/cold_start.py [--runs 5] [--ref <コミット>] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import app_entry_point, copy_app, format_ms, free_port, request, stop_server
+
+PHASES_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+if hasattr(app_module, 'create_app'):
+    app_module.create_app()
+created = time.perf_counter()
+status = app_module.app.test_client().get('/').status_code
+first_response = time.perf_counter()
+print('RESULT ' + json.dumps({
+    'status': status,
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first_response - created) * 1000,
+    'total_ms': (first_response - started) * 1000,
+    'modules': sorted(name for name in ('apscheduler', 'gevent', 'pytz') if name in sys.modules),
+}))
+'''
+
+
+def reset_instance(workdir, template):
+    """instance/ を空にするか、初期化済みのDB（template）で置き換える"""
+    instance = os.path.join(workdir, 'instance')
+    shutil.rmtree(instance)
+    if template:
+        shutil.copytree(template, instance)
+    else:
+        os.makedirs(instance)
+
+
+def measure_phases(workdir):
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    output = subprocess.run([sys.executable, '-c', PHASES_SCRIPT], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    for line in output.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError('計測結果が出力されませんでした')
+
+
+def measure_first_byte(workdir, worker_class, workers):
+    """gunicorn の起動から GET / の応答（ステータス行）が返るまでのミリ秒"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(workers), LOG_LEVEL='WARNING')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         app_entry_point(workdir)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            try:
+                status, _ = request(port, 'GET', '/', timeout=30)
+            except OSError:
+                time.sleep(0.005)
+                continue
+            if status == 200:
+                return (time.perf_counter() - started) * 1000
+            raise RuntimeError(f'GET / が {status} を返しました')
+        raise RuntimeError('gunicorn が応答しませんでした')
+    finally:
+        stop_server(process)
+
+
+def summarize(values):
+    return {'median': statistics.median(values), 'min': min(values), 'runs': values}
+
+
+def run(ref, args):
+    workdir = tempfile.mkdtemp(prefix='cold-start-')
+    copy_app(workdir, ref)
+    # 初期化済みのDBを用意する（1回起動して終了させたときの instance/）
+    measure_phases(workdir)
+    template = os.path.join(tempfile.mkdtemp(prefix='cold-start-instance-'), 'instance')
+    shutil.copytree(os.path.join(workdir, 'instance'), template,
+                    ignore=shutil.ignore_patterns('*.lock', 'prometheus'))
+
+    results = {'ref': ref or 'working tree'}
+    for state, source in (('fresh', None), ('existing', template)):
+        phases = []
+        first_byte = []
+        for _ in range(args.runs):
+            reset_instance(workdir, source)
+            phases.append(measure_phases(workdir))
+            reset_instance(workdir, source)
+            first_byte.append(measure_first_byte(workdir, args.worker_class, args.workers))
+        results[state] = {
+            key: summarize([phase[key] for phase in phases])
+            for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')
+        }
+        results[state]['modules'] = phases[-1]['modules']
+        results[state]['gunicorn_first_byte_ms'] = summarize(first_byte)
+    shutil.rmtree(workdir, ignore_errors=True)
+    shutil.rmtree(os.path.dirname(template), ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--ref', help='比較するコミット（作業ツリーの版の前に計測する）')
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    results = [run(args.ref, args)] if args.ref else []
+    results.append(run(None, args))
+
+    print(f"runs={args.runs} worker_class={args.worker_class} workers={args.workers} (中央値 / 最小, ms)")
+    print(f"{'version':<14} {'db':<9} {'import':>13} {'create_app':>13} {'first req':>13} "
+          f"{'in-process':>13} {'gunicorn':>13}  modules")
+    for result in results:
+        for state in ('fresh', 'existing'):
+            stats = result[state]
+            cells = [
+                f"{format_ms(stats[key]['median'])}/{format_ms(stats[key]['min'])}"
+                for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms', 'gunicorn_first_byte_ms')
+            ]
+            print(f"{result['ref'][:14]:<14} {state:<9} " + ' '.join(f'{cell:>13}' for cell in cells)
+                  + f"  {','.join(stats['modules'])}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
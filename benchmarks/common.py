@@ -0,0 +1,106 @@
+"""ベンチマーク共通の処理（アプリのコピー・gunicornの起動と停止・HTTPリクエスト・集計）"""
+import http.client
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILES = ['app.py', 'app_logging.py', 'date_window.py', 'metrics.py', 'gunicorn.conf.py']
+APP_DIRS = ['templates', 'static']
+
+
+def copy_app(workdir, ref=None):
+    """アプリ一式を作業ディレクトリにコピー（instance/ は空にしてDBを新規作成させる）
+
+    ref を指定すると、作業ツリーではなくそのコミットのアプリをコピーする。
+    """
+    if ref:
+        archive = subprocess.run(['git', 'archive', ref], cwd=ROOT, capture_output=True, check=True).stdout
+        subprocess.run(['tar', '-x', '-C', workdir], input=archive, check=True)
+        shutil.rmtree(os.path.join(workdir, 'instance'), ignore_errors=True)
+    else:
+        for name in APP_FILES:
+            shutil.copy(os.path.join(ROOT, name), workdir)
+        for name in APP_DIRS:
+            shutil.copytree(os.path.join(ROOT, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, 'instance'))
+
+
+def import_app(workdir):
+    """作業ディレクトリのアプリをこのプロセスに読み込み、create_app() まで済ませて返す"""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app as app_module
+    app_module.create_app()
+    return app_module
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None, timeout=30):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def app_entry_point(workdir):
+    """gunicorn に渡すアプリの指定（create_app() がない以前の版では app:app）"""
+    with open(os.path.join(workdir, 'app.py'), encoding='utf-8') as f:
+        return 'app:create_app()' if 'def create_app(' in f.read() else 'app:app'
+
+
+def start_server(workdir, port, worker_class, workers, extra_env=None, stdout=subprocess.DEVNULL):
+    """gunicorn.conf.py の設定でワーカークラス・ワーカー数だけを変えて起動し、応答するまで待つ"""
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(workers), **(extra_env or {}))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+         app_entry_point(workdir)],
+        cwd=workdir, env=env, stdout=stdout, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if request(port, 'GET', '/ping', timeout=1)[0] == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'gunicorn ({worker_class}) が起動しませんでした')
+
+
+def stop_server(process):
+    # SIGINT は処理中のリクエストを待たずに終了させる
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def format_ms(value):
+    return '-' if value is None else f'{value:.1f}'
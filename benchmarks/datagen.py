@@ -0,0 +1,136 @@
+"""ベンチマーク用の合成データ（時間枠・予約・一時保存された時間帯変更）の生成
+
+アプリが作成したスキーマのDBに対して、既存の時間枠・予約・変更を置き換える形で書き込む。
+同じ seed・基準日なら同じデータになる。
+
+使い方（アプリのコピーのDBに対して実行すること）:
+    python benchmarks/datagen.py path/to/instance/reservations.db --scale extreme [--seed 0]
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+from common import ROOT
+
+# members: 部員数, bands: バンド数, history_days: 過去の日数,
+# weekly_requests: 部員1人の1週間あたりの練習希望数, pending_ratio: 変更が一時保存されている日の割合
+SCALES = {
+    'small': {'members': 30, 'bands': 8, 'history_days': 28, 'weekly_requests': 1.5, 'pending_ratio': 0.1},
+    'realistic': {'members': 80, 'bands': 20, 'history_days': 180, 'weekly_requests': 2, 'pending_ratio': 0.2},
+    'extreme': {'members': 500, 'bands': 120, 'history_days': 3 * 365, 'weekly_requests': 3, 'pending_ratio': 0.5},
+}
+
+# 曜日（月曜日=0）ごとの時間枠（アプリのデフォルト時間帯と同じ並び）
+SLOT_PATTERNS = {
+    0: ['〜16:50', '16:50〜18:00'],
+    1: ['16:50〜18:00'],
+    2: ['〜16:50', '16:50〜18:00'],
+    3: ['16:50〜18:00'],
+    4: ['16:50〜18:00'],
+    5: ['12:30~14:30', '14:30~16:30'],
+    6: ['12:30~14:30', '14:30~16:30'],
+}
+EXTRA_SLOT = '18:00〜19:00'
+
+# 管理画面に表示される今週の日曜日から3週間分まで未来のデータを作る
+FUTURE_DAYS = 21
+
+
+def daily_request_count(rng, members, probability):
+    """1日の練習希望数（二項分布を正規分布で近似）"""
+    mean = members * probability
+    deviation = math.sqrt(mean * (1 - probability))
+    return max(0, min(members, round(rng.gauss(mean, deviation))))
+
+
+def generate(db_path, scale='realistic', today=None, seed=0, history_days=None):
+    """合成データを書き込み、テーブルごとの行数を返す（history_days で過去の日数だけを変えられる）"""
+    params = dict(SCALES[scale])
+    if history_days is not None:
+        params['history_days'] = history_days
+    rng = random.Random(seed)
+    today = today or date.today()
+    members = [
+        (f'部員{i:03d}', f'バンド{rng.randrange(params["bands"]):03d}')
+        for i in range(params['members'])
+    ]
+    week_sunday = today - timedelta(days=(today.weekday() + 1) % 7)
+    first_date = today - timedelta(days=params['history_days'])
+    last_date = week_sunday + timedelta(days=FUTURE_DAYS - 1)
+    probability = params['weekly_requests'] / 7
+
+    slot_rows = []
+    request_rows = []
+    change_rows = []
+    created_at = datetime(today.year, today.month, today.day).isoformat(sep=' ')
+    current = first_date
+    while current <= last_date:
+        key = current.isoformat()
+        slots = SLOT_PATTERNS[current.weekday()]
+        slot_rows.extend((key, slot) for slot in slots)
+
+        # 先の日付ほど希望はまだ集まっていない
+        days_ahead = (current - today).days
+        fill = 1.0 if days_ahead <= 0 else max(0.2, 1 - days_ahead / FUTURE_DAYS)
+        for user_name, band_name in rng.sample(members, daily_request_count(rng, len(members), probability * fill)):
+            request_rows.append((key, user_name, band_name, rng.choice(slots)))
+
+        if current >= week_sunday and rng.random() < params['pending_ratio']:
+            new_slots = slots + [EXTRA_SLOT] if rng.random() < 0.5 else slots[:1]
+            change_rows.extend((key, slot, created_at) for slot in new_slots)
+        current += timedelta(days=1)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            for table in ('practice_request', 'time_slot', 'time_slot_change'):
+                conn.execute(f'DELETE FROM {table}')
+            conn.executemany('INSERT INTO time_slot (date, slot) VALUES (?, ?)', slot_rows)
+            conn.executemany(
+                'INSERT INTO practice_request (date, user_name, band_name, time_slot) VALUES (?, ?, ?, ?)',
+                request_rows
+            )
+            conn.executemany(
+                'INSERT INTO time_slot_change (date, slot, created_at) VALUES (?, ?, ?)', change_rows
+            )
+            # 予約数の集計も作り直す
+            conn.execute('DELETE FROM slot_occupancy')
+            conn.execute(
+                'INSERT INTO slot_occupancy (date, slot, count) '
+                'SELECT date, time_slot, COUNT(*) FROM practice_request GROUP BY date, time_slot'
+            )
+            # 各ワーカーのキャッシュを無効にする
+            conn.execute('UPDATE data_version SET version = version + 1')
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+
+    return {
+        'time_slot': len(slot_rows),
+        'practice_request': len(request_rows),
+        'time_slot_change': len(change_rows),
+        'first_date': first_date.isoformat(),
+        'last_date': last_date.isoformat(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='realistic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--today', type=date.fromisoformat, help='基準日（省略時は今日）')
+    parser.add_argument('--history-days', type=int, help='過去の日数（省略時は規模ごとの既定値）')
+    args = parser.parse_args()
+
+    if os.path.abspath(args.db_path) == os.path.join(ROOT, 'instance', 'reservations.db'):
+        sys.exit('リポジトリのDBは上書きできません。アプリのコピーのDBを指定してください')
+    print(generate(args.db_path, args.scale, args.today, args.seed, args.history_days))
+
+
+if __name__ == '__main__':
+    main()
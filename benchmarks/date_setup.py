@@ -0,0 +1,99 @@
+"""リクエストごとの日付まわりの準備（週・受付期間・管理画面の3週間・月カレンダー・日付キー）の時間
+
+inline: date_window.py を使う前にルートごとに行っていた計算（同じ処理をこのスクリプト内で再現）
+new day: 日付が変わった直後の1回目（DateWindow の作成と、月カレンダー・日付キーのキャッシュの作り直し）
+cached: 同じ日の2回目以降（get_date_window() とキャッシュ済みの日付キー）
+
+どれも --keys 件の日付キー（読み込んだ行ごとの make_date_key）を含む。
+
+使い方:
+    python benchmarks/date_setup.py [--number 20000] [--today 2026-10-29]
+"""
+import argparse
+import calendar
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+
+from common import ROOT
+
+sys.path.insert(0, ROOT)
+import date_window  # noqa: E402
+
+
+def inline_setup(today, keys):
+    """以前の index()・admin() と同じ計算（月カレンダー・受付期間のキー・3週間・次回反映時刻・日付キー）"""
+    year, month = today.year, today.month
+    calendars = [calendar.monthcalendar(year, month)]
+    if calendar.monthrange(year, month)[1] - today.day < 14:
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        calendars.append(calendar.monthcalendar(next_year, next_month))
+
+    days_since_sunday = (today.weekday() + 1) % 7
+    week_sunday = today - timedelta(days=days_since_sunday)
+    valid_dates = set()
+    for week in range(2):
+        for day in range(7):
+            current = week_sunday + timedelta(weeks=week, days=day)
+            valid_dates.add(f'{current.year}-{current.month}-{current.day}')
+
+    week_dates = []
+    for week in range(3):
+        for day in range(7):
+            week_dates.append({
+                'date': week_sunday + timedelta(weeks=week, days=day),
+                'week_label': date_window.WEEK_LABELS[week] if day == 0 else None
+            })
+    next_update_time = datetime.combine(
+        week_sunday + timedelta(weeks=1),
+        datetime.min.time().replace(hour=date_window.WEEKLY_UPDATE_HOUR, minute=date_window.WEEKLY_UPDATE_MINUTE),
+        tzinfo=date_window.JST
+    )
+    date_keys = [f'{d.year}-{d.month}-{d.day}' for d in keys]
+    return calendars, valid_dates, week_dates, next_update_time, date_keys
+
+
+def new_day_setup(today, keys):
+    date_window.get_month_grid.cache_clear()
+    date_window.make_date_key.cache_clear()
+    window = date_window.DateWindow(today)
+    return window, [date_window.make_date_key(d) for d in keys]
+
+
+def cached_setup(today, keys):
+    window = date_window.get_date_window(today)
+    return window, [date_window.make_date_key(d) for d in keys]
+
+
+def measure(setup, today, keys, number):
+    """1回あたりのマイクロ秒（5回繰り返した最小値）"""
+    return min(timeit.repeat(lambda: setup(today, keys), number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=60, help='1リクエストで作る日付キーの数')
+    parser.add_argument('--today', type=date.fromisoformat, default=date(2026, 10, 29),
+                        help='基準日（来月のカレンダーも表示される月末近くが既定）')
+    args = parser.parse_args()
+
+    # 以前の app.py と同じく、monthcalendar を日曜日始まりにする
+    calendar.setfirstweekday(calendar.SUNDAY)
+    keys = [args.today + timedelta(days=offset - args.keys // 2) for offset in range(args.keys)]
+    # 同じ結果になることを確認してから測る
+    inline = inline_setup(args.today, keys)
+    window, date_keys = cached_setup(args.today, keys)
+    assert inline[1] == window.valid_dates and inline[4] == date_keys
+    assert [list(map(list, grid)) for grid in inline[0]] == [
+        [list(week) for week in entry['calendar']] for entry in window.calendars
+    ]
+    assert inline[2] == list(window.week_dates) and inline[3] == window.next_update_time
+
+    print(f"today={args.today} keys={args.keys} number={args.number} (1リクエストあたり, us)")
+    for name, setup in (('inline', inline_setup), ('new day', new_day_setup), ('cached', cached_setup)):
+        print(f'{name:<8} {measure(setup, args.today, keys, args.number):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""予約エクスポート（/admin/export_reservations）のメモリ使用量の確認
+
+アプリを一時ディレクトリにコピーし、合成した予約を大量に入れたDBに対して
+CSV・NDJSON（gzipあり・なし）を最後まで読み出す。出力中のPythonのメモリ確保量の
+ピーク（tracemalloc）が上限を超えた場合は終了コード1で終わる。
+
+使い方:
+    python benchmarks/export_memory.py [--rows 300000] [--ceiling-mb 16] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from common import copy_app
+
+USERS_PER_DAY = 100
+SLOTS = ['12:30~14:30', '14:30~16:30', '16:50〜18:00']
+
+
+def fill_database(db_path, rows):
+    """1日あたり USERS_PER_DAY 人の予約を rows 件になるまで過去にさかのぼって作成"""
+    days = -(-rows // USERS_PER_DAY)
+    first_date = date(2000, 1, 1)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executemany(
+            'INSERT INTO time_slot (date, slot) VALUES (?, ?)',
+            [((first_date + timedelta(days=d)).isoformat(), slot)
+             for d in range(days) for slot in SLOTS[:2]]
+        )
+
+        def reservations():
+            for i in range(rows):
+                d, user = divmod(i, USERS_PER_DAY)
+                yield ((first_date + timedelta(days=d)).isoformat(), f'user{user:03d}',
+                       f'band{user % 17}', SLOTS[user % len(SLOTS)])
+
+        conn.executemany(
+            'INSERT INTO practice_request (date, user_name, band_name, time_slot) VALUES (?, ?, ?, ?)',
+            reservations()
+        )
+    conn.close()
+    return first_date, first_date + timedelta(days=days - 1)
+
+
+def measure(client, url, gzip):
+    headers = {'Accept-Encoding': 'gzip' if gzip else 'identity'}
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    response = client.get(url, headers=headers, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'content_encoding': response.headers.get('Content-Encoding'),
+        'bytes': size,
+        'seconds': elapsed,
+        'peak_mb': peak / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--ceiling-mb', type=float, default=16)
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='export-memory-')
+    copy_app(workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    import app as app_module
+    app_module.create_app()  # 一時ディレクトリのDBを作成する
+
+    try:
+        start, end = fill_database(os.path.join(workdir, 'instance', 'reservations.db'), args.rows)
+        client = app_module.app.test_client()
+        results = {}
+        for export_format in ('csv', 'ndjson'):
+            for gzip in (False, True):
+                url = f'/admin/export_reservations?format={export_format}&start={start}&end={end}'
+                results[f"{export_format}{'+gzip' if gzip else ''}"] = measure(client, url, gzip)
+    finally:
+        app_module.cleanup_scheduler()
+
+    print(f"rows={args.rows} ceiling={args.ceiling_mb}MB")
+    print(f"{'format':<12} {'status':>6} {'bytes':>12} {'seconds':>8} {'peak_mb':>8}")
+    failed = False
+    for name, result in results.items():
+        print(f"{name:<12} {result['status']:>6} {result['bytes']:>12} "
+              f"{result['seconds']:>8.2f} {result['peak_mb']:>8.2f}")
+        failed = failed or result['status'] != 200 or result['peak_mb'] > args.ceiling_mb
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if failed:
+        print('メモリ使用量が上限を超えたか、エクスポートに失敗しました')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""月カレンダー・管理画面の週ブロックの描画済みHTML（断片キャッシュ）による描画時間の差
+
+1. アプリを一時ディレクトリにコピーし、このプロセス内で起動する
+2. datagen の --scales ごとの合成データ（1日あたりの予約者数が違う）を書き込む
+3. Flask のテストクライアントで / と /admin を --requests 回ずつ呼び出し、平均を測る
+   （render: 毎回断片キャッシュだけを空にして描画し直す, cached: 断片キャッシュあり。
+   どちらもカレンダーデータはキャッシュ済みのため、差がテンプレートの描画にかかる時間になる）
+
+使い方:
+    python benchmarks/fragment_render.py [--scales realistic extreme] [--requests 30]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from common import copy_app, format_ms, import_app
+import datagen
+
+ROUTES = ('/', '/admin')
+
+
+def measure(app_module, client, path, requests, clear_fragments):
+    timings = []
+    for _ in range(requests):
+        if clear_fragments:
+            app_module.fragment_cache.clear()
+        started = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} が {response.status_code} を返しました')
+    return statistics.fmean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=sorted(datagen.SCALES), default=['realistic', 'extreme'])
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='fragment-render-')
+    copy_app(workdir)
+    app_module = import_app(workdir)
+    db_path = os.path.join(workdir, 'instance', 'reservations.db')
+    today = app_module.get_date_window().today
+    client = app_module.app.test_client()
+
+    results = []
+    for scale in args.scales:
+        datagen.generate(db_path, scale, today, args.seed)
+        with app_module.app.app_context():
+            window = app_module.get_date_window()
+            users = app_module.load_calendar_data(window.admin_start, window.admin_end)['practice_requests']
+        result = {
+            'scale': scale,
+            'users_per_day': statistics.fmean(len(day) for day in users.values()) if users else 0,
+            'routes': {},
+        }
+        for route in ROUTES:
+            client.get(route)
+            result['routes'][route] = {
+                'render_ms': measure(app_module, client, route, args.requests, True),
+                'cached_ms': measure(app_module, client, route, args.requests, False),
+            }
+        results.append(result)
+    app_module.cleanup_scheduler()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"requests={args.requests} (平均, ms)")
+    print(f"{'scale':<10} {'users/day':>9} {'route':<7} {'render':>8} {'cached':>8}")
+    for result in results:
+        for route, stats in result['routes'].items():
+            print(f"{result['scale']:<10} {result['users_per_day']:>9.1f} {route:<7} "
+                  f"{format_ms(stats['render_ms']):>8} {format_ms(stats['cached_ms']):>8}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
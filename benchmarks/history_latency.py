@@ -0,0 +1,104 @@
+"""予約の履歴の長さとページのレイテンシ（履歴が何年分に増えても一定であることの確認）
+
+1. アプリを一時ディレクトリにコピーし、このプロセス内で起動する
+2. --history の日数ごとに、過去の日数だけを変えた datagen の合成データを書き込む
+3. Flask のテストクライアントで各ルートを --requests 回ずつ呼び出し、平均を測る
+   （cold: 毎回データバージョンを進めてキャッシュを使わない, warm: キャッシュあり）
+
+履歴0日では今日より前の日（今月・今週の分）にも予約がないため、それらも読み込む cold の
+/get_time_slots（今月全体）・/admin（今週の日曜日から）は軽くなる。1年と3年で変わらないことを見る。
+
+使い方:
+    python benchmarks/history_latency.py [--scale realistic] [--history 0 365 1095] [--requests 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from common import copy_app, format_ms, import_app
+import datagen
+
+ROUTES = ('/', '/admin', '/get_time_slots')
+
+
+def bump_data_version(db_path):
+    """キャッシュを無効にする（別の接続からデータバージョンを進める）"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            conn.execute('UPDATE data_version SET version = version + 1')
+    finally:
+        conn.close()
+
+
+def measure(client, path, requests, db_path=None):
+    """平均のミリ秒（db_path を渡すと毎回キャッシュを無効にしてから呼び出す）"""
+    timings = []
+    for _ in range(requests):
+        if db_path:
+            bump_data_version(db_path)
+        started = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} が {response.status_code} を返しました')
+    return statistics.fmean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='realistic')
+    parser.add_argument('--history', type=int, nargs='+', default=[0, 365, 3 * 365], help='過去の日数')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='history-latency-')
+    copy_app(workdir)
+    app_module = import_app(workdir)
+    db_path = os.path.join(workdir, 'instance', 'reservations.db')
+    window = app_module.get_date_window()
+    selectable = window.selectable_dates[len(window.selectable_dates) // 2]
+    paths = {
+        '/': '/',
+        '/admin': '/admin',
+        '/get_time_slots': f'/get_time_slots/{selectable.year}/{selectable.month}/{selectable.day}',
+    }
+    client = app_module.app.test_client()
+
+    results = []
+    for history_days in args.history:
+        data = datagen.generate(db_path, args.scale, window.today, args.seed, history_days)
+        result = {'history_days': history_days, 'practice_request': data['practice_request'], 'routes': {}}
+        for route in ROUTES:
+            client.get(paths[route])
+            result['routes'][route] = {
+                'cold_ms': measure(client, paths[route], args.requests, db_path),
+                'warm_ms': measure(client, paths[route], args.requests),
+            }
+        results.append(result)
+    app_module.cleanup_scheduler()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"scale={args.scale} requests={args.requests} (平均, ms。cold: キャッシュなし / warm: キャッシュあり)")
+    print(f"{'history':>8} {'rows':>8} " + ' '.join(f'{route:>22}' for route in ROUTES))
+    for result in results:
+        cells = [
+            f"{format_ms(stats['cold_ms'])} / {format_ms(stats['warm_ms'])}"
+            for stats in result['routes'].values()
+        ]
+        print(f"{result['history_days']:>7}d {result['practice_request']:>8} "
+              + ' '.join(f'{cell:>22}' for cell in cells))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
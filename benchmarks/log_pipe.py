@@ -0,0 +1,132 @@
+"""ログの出力先が詰まったときの /submit_practice のスループットの確認
+
+gunicorn の標準出力をパイプにつなぎ、指定した速度でしか読み出さないことで、
+Renderのログの出力先が詰まった状態を再現する。--seconds の間 --concurrency の同時接続で
+/submit_practice を呼び出し、処理できた件数とレイテンシを表示する。
+--ref に以前のコミット（print() で出力していた版など）を渡すと、その版と比較できる。
+
+どちらの版も1件の送信ごとに1行のログを出すよう LOG_LEVELS=app=DEBUG で起動する。
+
+使い方:
+    python benchmarks/log_pipe.py [--drain-bytes-per-sec 2048] [--seconds 10] [--ref <コミット>]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from common import copy_app, format_ms, free_port, percentile, request, start_server, stop_server
+from run import BenchContext, build_submit
+
+
+def drain(pipe, bytes_per_sec, counter):
+    """bytes_per_sec の速度でパイプから読み出す（0 なら制限なし）"""
+    chunk = 1024 if bytes_per_sec else 65536
+    while True:
+        data = pipe.read1(chunk) if hasattr(pipe, 'read1') else pipe.read(chunk)
+        if not data:
+            return
+        counter[0] += len(data)
+        if bytes_per_sec:
+            time.sleep(len(data) / bytes_per_sec)
+
+
+def load_window(workdir):
+    sys.path.insert(0, workdir)
+    try:
+        from date_window import get_date_window
+        return get_date_window()
+    finally:
+        sys.path.remove(workdir)
+
+
+def run(ref, args):
+    workdir = tempfile.mkdtemp(prefix='log-pipe-')
+    copy_app(workdir, ref)
+    port = free_port()
+    process = start_server(workdir, port, args.worker_class, args.workers,
+                           extra_env={'LOG_LEVELS': 'app=DEBUG'}, stdout=subprocess.PIPE)
+    log_bytes = [0]
+    threading.Thread(target=drain, args=(process.stdout, args.drain_bytes_per_sec, log_bytes),
+                     daemon=True).start()
+
+    ctx = BenchContext(f'{workdir}/instance/reservations.db', load_window(workdir), args.seed)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+
+    def worker(index):
+        nonlocal errors
+        i = 0
+        while time.monotonic() < deadline:
+            method, path, body = build_submit(ctx, i, f'{index}')
+            i += 1
+            started = time.perf_counter()
+            try:
+                status, _ = request(port, method, path, body, timeout=args.seconds + 30)
+            except OSError:
+                status = None
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    stop_server(process)
+    # 書き込みで止まっているワーカーが残らないよう、読み出し側を閉じる
+    process.stdout.close()
+
+    return {
+        'ref': ref or 'working tree',
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'max_ms': max(latencies) if latencies else None,
+        'log_bytes_read': log_bytes[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drain-bytes-per-sec', type=int, default=2048,
+                        help='ログを読み出す速度（0 で制限なし）')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ref', help='比較するコミット（作業ツリーの版の前に計測する）')
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    results = [run(args.ref, args)] if args.ref else []
+    results.append(run(None, args))
+
+    print(f"drain={args.drain_bytes_per_sec}B/s seconds={args.seconds} concurrency={args.concurrency} "
+          f"worker_class={args.worker_class} workers={args.workers}")
+    print(f"{'version':<14} {'req':>6} {'err':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'max':>9} {'log bytes':>10}")
+    for result in results:
+        print(f"{result['ref'][:14]:<14} {result['requests']:>6} {result['errors']:>4} "
+              f"{format_ms(result['throughput_rps']):>8} {format_ms(result['p50_ms']):>8} "
+              f"{format_ms(result['p95_ms']):>8} {format_ms(result['max_ms']):>9} {result['log_bytes_read']:>10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""ルートごとのレイテンシ・スループット・SQLクエリ数のベンチマーク
+
+1. アプリを一時ディレクトリにコピーし、datagen の合成データを書き込む
+2. gunicorn（gunicorn.conf.py の設定）を起動し、ルートごとに --concurrency の同時接続で
+   --requests 回ずつ呼び出して p50/p95/p99・スループットを測る
+3. 同じDBに対してこのプロセス内でアプリを動かし、1リクエストあたりのSQL文の数を数える
+
+結果はJSONで保存し、--baseline に以前の結果を渡すと差分を表示する。
+
+使い方:
+    python benchmarks/run.py --scale realistic --concurrency 8 --requests 200 --output result.json
+    python benchmarks/run.py --scale extreme --baseline result.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from common import ROOT, copy_app, format_ms, free_port, percentile, request, start_server, stop_server
+import datagen
+
+# 時間帯変更の即時反映1回あたりに変更する日数
+APPLY_CHANGE_DATES = 7
+
+
+class BenchContext:
+    """ワークロードの生成に使う、DBのパスと受付期間・管理画面の日付"""
+
+    def __init__(self, db_path, window, seed):
+        self.db_path = db_path
+        self.rng = random.Random(seed)
+        self.admin_dates = list(window.admin_dates)
+        conn = sqlite3.connect(db_path)
+        try:
+            self.slots_by_date = {}
+            for selectable_date in window.selectable_dates:
+                slots = [row[0] for row in conn.execute(
+                    'SELECT slot FROM time_slot WHERE date = ? ORDER BY id', (selectable_date.isoformat(),)
+                )]
+                if slots:
+                    self.slots_by_date[selectable_date] = slots
+        finally:
+            conn.close()
+        self.selectable_dates = sorted(self.slots_by_date)
+        self.cancel_targets = {}
+
+    def random_slot(self):
+        target = self.rng.choice(self.selectable_dates)
+        return target, self.rng.choice(self.slots_by_date[target])
+
+    def execute(self, sql=None, rows=((),)):
+        """DBに直接書き込み、各ワーカーのキャッシュを無効にする（sql なしならキャッシュの無効化だけ）"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                if sql:
+                    conn.executemany(sql, rows)
+                conn.execute('UPDATE data_version SET version = version + 1')
+        finally:
+            conn.close()
+
+
+def date_body(target, **values):
+    return json.dumps({'year': target.year, 'month': target.month, 'day': target.day, **values},
+                      ensure_ascii=False)
+
+
+def build_get_time_slots(ctx, i, tag):
+    target = ctx.rng.choice(ctx.selectable_dates)
+    return 'GET', f'/get_time_slots/{target.year}/{target.month}/{target.day}', None
+
+
+def build_submit(ctx, i, tag):
+    target, slot = ctx.random_slot()
+    return 'POST', '/submit_practice', date_body(
+        target, user_name=f'bench-{tag}-{i}', band_name='bench', time_slot=slot
+    )
+
+
+def prepare_cancel(ctx, count, tag):
+    """キャンセルする予約を先に登録しておく"""
+    targets = [ctx.random_slot() for _ in range(count)]
+    ctx.cancel_targets[tag] = targets
+    ctx.execute(
+        'INSERT INTO practice_request (date, user_name, band_name, time_slot) VALUES (?, ?, ?, ?)',
+        [(target.isoformat(), f'bench-cancel-{tag}-{i}', 'bench', slot) for i, (target, slot) in enumerate(targets)]
+    )
+    ctx.execute(
+        'INSERT INTO slot_occupancy (date, slot, count) VALUES (?, ?, 1) '
+        'ON CONFLICT (date, slot) DO UPDATE SET count = count + 1',
+        [(target.isoformat(), slot) for target, slot in targets]
+    )
+
+
+def build_cancel(ctx, i, tag):
+    target, slot = ctx.cancel_targets[tag][i]
+    return 'POST', '/cancel_practice', date_body(target, user_name=f'bench-cancel-{tag}-{i}', time_slot=slot)
+
+
+def prepare_apply(ctx, count, tag):
+    """合成データの一時保存された変更を消し、毎回同じ規模の変更を反映させる"""
+    ctx.execute('DELETE FROM time_slot_change')
+
+
+def before_apply(ctx, i, tag):
+    rows = []
+    for target in ctx.rng.sample(ctx.admin_dates, APPLY_CHANGE_DATES):
+        slots = datagen.SLOT_PATTERNS[target.weekday()]
+        new_slots = slots + [datagen.EXTRA_SLOT] if i % 2 == 0 else slots
+        rows.extend((target.isoformat(), slot, datetime.now().isoformat(sep=' ')) for slot in new_slots)
+    ctx.execute('INSERT INTO time_slot_change (date, slot, created_at) VALUES (?, ?, ?)', rows)
+
+
+# build: (ctx, i, tag) -> (method, path, body)
+# prepare: 計測前に1回（count件分の準備）, before_each: 各リクエストの前（計測対象外）, serial: 同時接続1で実行
+ROUTES = {
+    '/': {'build': lambda ctx, i, tag: ('GET', '/', None)},
+    '/admin': {'build': lambda ctx, i, tag: ('GET', '/admin', None)},
+    '/get_time_slots': {'build': build_get_time_slots},
+    '/submit_practice': {'build': build_submit},
+    '/cancel_practice': {'build': build_cancel, 'prepare': prepare_cancel},
+    '/admin/apply_changes_now': {
+        'build': lambda ctx, i, tag: ('POST', '/admin/apply_changes_now', '{}'),
+        'prepare': prepare_apply,
+        'before_each': before_apply,
+        'serial': True,
+    },
+}
+
+
+def run_http_phase(port, ctx, route, args):
+    spec = ROUTES[route]
+    warmup = args.warmup
+    total = warmup + args.requests
+    tag = 'http'
+    if 'prepare' in spec:
+        spec['prepare'](ctx, total, tag)
+
+    def call(i):
+        if 'before_each' in spec:
+            spec['before_each'](ctx, i, tag)
+        method, path, body = spec['build'](ctx, i, tag)
+        started = time.perf_counter()
+        try:
+            status, _ = request(port, method, path, body)
+        except OSError:
+            return None
+        elapsed = (time.perf_counter() - started) * 1000
+        return elapsed if status < 400 else None
+
+    for i in range(warmup):
+        call(i)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = itertools.count(warmup)
+
+    def worker():
+        nonlocal errors
+        for i in counter:
+            if i >= total:
+                return
+            elapsed = call(i)
+            with lock:
+                if elapsed is None:
+                    errors += 1
+                else:
+                    latencies.append(elapsed)
+
+    concurrency = 1 if spec.get('serial') else args.concurrency
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': statistics.fmean(latencies) if latencies else None,
+        'max_ms': max(latencies) if latencies else None,
+        'throughput_rps': len(latencies) / wall if wall else None,
+    }
+
+
+def count_sql(app_module, ctx, route, samples):
+    """1回目（キャッシュなし）と2回目以降の平均のSQL文の数"""
+    from sqlalchemy import event
+
+    spec = ROUTES[route]
+    tag = 'sql'
+    if 'prepare' in spec:
+        spec['prepare'](ctx, samples, tag)
+    client = app_module.app.test_client()
+    counts = []
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        # 別プロセス（gunicorn・直接の書き込み）での変更をキャッシュに反映させるため、先にバージョンを進める
+        ctx.execute()
+        for i in range(samples):
+            if 'before_each' in spec:
+                spec['before_each'](ctx, i, tag)
+            method, path, body = spec['build'](ctx, i, tag)
+            statements.clear()
+            response = client.open(path, method=method, data=body, content_type='application/json')
+            counts.append(len(statements) if response.status_code < 400 else None)
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+    warm = [count for count in counts[1:] if count is not None]
+    return {
+        'sql_queries_cold': counts[0],
+        'sql_queries_warm': statistics.fmean(warm) if warm else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(result, baseline=None):
+    meta = result['meta']
+    print(f"commit={meta['commit']} scale={meta['scale']} worker_class={meta['worker_class']} "
+          f"workers={meta['workers']} concurrency={meta['concurrency']} data={result['data']}")
+    header = f"{'route':<26} {'req':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'sql':>9}"
+    if baseline:
+        header += f" {'p95 vs base':>12} {'rps vs base':>12}"
+    print(header)
+    for route, stats in result['routes'].items():
+        sql = f"{stats['sql_queries_cold']}/{format_ms(stats['sql_queries_warm'])}"
+        line = (f"{route:<26} {stats['requests']:>5} {stats['errors']:>4} {format_ms(stats['p50_ms']):>8} "
+                f"{format_ms(stats['p95_ms']):>8} {format_ms(stats['p99_ms']):>8} "
+                f"{format_ms(stats['throughput_rps']):>8} {sql:>9}")
+        base = (baseline or {}).get('routes', {}).get(route)
+        if base:
+            line += f" {relative_change(stats['p95_ms'], base['p95_ms']):>12}"
+            line += f" {relative_change(stats['throughput_rps'], base['throughput_rps']):>12}"
+        print(line)
+    print('sql: 1回目（キャッシュなし）/ 2回目以降の平均')
+
+
+def relative_change(value, base):
+    if value is None or not base:
+        return '-'
+    return f'{(value - base) / base * 100:+.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='realistic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='ルートごとの計測リクエスト数')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--sql-samples', type=int, default=3)
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--baseline', help='比較する以前の結果のJSONファイル')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    copy_app(workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    # スキーマを作成する（このプロセスがスケジューラーのリーダーになり、gunicorn側では動かない）
+    import app as app_module
+    app_module.create_app()
+
+    db_path = os.path.join(workdir, 'instance', 'reservations.db')
+    with app_module.app.app_context():
+        window = app_module.get_date_window()
+    data = datagen.generate(db_path, args.scale, window.today, args.seed)
+    ctx = BenchContext(db_path, window, args.seed)
+
+    routes = {}
+    port = free_port()
+    process = start_server(workdir, port, args.worker_class, args.workers)
+    try:
+        for route in args.routes:
+            routes[route] = run_http_phase(port, ctx, route, args)
+            print(f"{route}: {routes[route]['requests']}件 p95={format_ms(routes[route]['p95_ms'])}ms", file=sys.stderr)
+    finally:
+        stop_server(process)
+
+    for route in args.routes:
+        routes[route].update(count_sql(app_module, ctx, route, args.sql_samples))
+    app_module.cleanup_scheduler()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'scale': args.scale,
+            'seed': args.seed,
+            'worker_class': args.worker_class,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+        },
+        'data': data,
+        'routes': routes,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""sync ワーカーと gevent ワーカーでの同時アクセス時のレイテンシ比較
+
+アプリを一時ディレクトリにコピーして（DBは新規作成）、gunicorn.conf.py の設定で
+ワーカークラスだけを切り替えて起動し、次の負荷を同時にかける。
+
+- 遅い回線の利用者: /submit_practice のボディを少しずつ送り続ける接続
+- 通常の利用者: /, /get_time_slots, /submit_practice を順番に呼び出す接続
+
+使い方:
+    python benchmarks/serving_modes.py [--clients 16] [--slow-clients 2] [--duration 15] [--json out.json]
+"""
+import argparse
+import json
+import shutil
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+from common import copy_app, format_ms, free_port, percentile, request, start_server, stop_server
+
+ROUTES = ['/', '/get_time_slots', '/submit_practice']
+
+
+def find_target_date(port):
+    """時間枠のある受付期間内の日付と、その最初の時間枠"""
+    status, body = request(port, 'GET', '/get_time_slots_range')
+    for date_key, slots in json.loads(body)['dates'].items():
+        if slots:
+            return [int(x) for x in date_key.split('-')], slots[0]['id']
+    raise RuntimeError('時間枠のある日付がありません')
+
+
+def slow_uploader(port, stop, byte_interval):
+    """ボディを1バイトずつ送る /submit_practice（遅いモバイル回線の想定）"""
+    body = json.dumps({'year': 2000, 'month': 1, 'day': 1}).encode()
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+                sock.sendall(
+                    b'POST /submit_practice HTTP/1.1\r\nHost: localhost\r\n'
+                    b'Content-Type: application/json\r\n'
+                    + f'Content-Length: {len(body)}\r\n\r\n'.encode()
+                )
+                for i in range(len(body)):
+                    if stop.is_set():
+                        break
+                    sock.sendall(body[i:i + 1])
+                    time.sleep(byte_interval)
+                sock.recv(65536)
+        except OSError:
+            time.sleep(0.1)
+
+
+def client(port, client_id, stop, target, latencies, errors):
+    (year, month, day), slot = target
+    count = 0
+    while not stop.is_set():
+        for route in ROUTES:
+            if route == '/get_time_slots':
+                method, path, body = 'GET', f'/get_time_slots/{year}/{month}/{day}', None
+            elif route == '/submit_practice':
+                method, path = 'POST', '/submit_practice'
+                body = json.dumps({
+                    'year': year, 'month': month, 'day': day, 'time_slot': slot,
+                    'user_name': f'load-{client_id}-{count}', 'band_name': 'load'
+                })
+            else:
+                method, path, body = 'GET', route, None
+            started = time.perf_counter()
+            try:
+                status, _ = request(port, method, path, body)
+                if status >= 400:
+                    errors[route] += 1
+                    continue
+            except OSError:
+                errors[route] += 1
+                continue
+            latencies[route].append((time.perf_counter() - started) * 1000)
+        count += 1
+
+
+def run_mode(worker_class, args):
+    workdir = tempfile.mkdtemp(prefix=f'serving-{worker_class}-')
+    copy_app(workdir)
+    port = free_port()
+    process = start_server(workdir, port, worker_class, args.workers)
+    try:
+        target = find_target_date(port)
+        latencies = {route: [] for route in ROUTES}
+        errors = {route: 0 for route in ROUTES}
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=slow_uploader, args=(port, stop, args.slow_byte_interval), daemon=True)
+            for _ in range(args.slow_clients)
+        ]
+        threads += [
+            threading.Thread(target=client, args=(port, i, stop, target, latencies, errors), daemon=True)
+            for i in range(args.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=5)
+    finally:
+        stop_server(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {}
+    for route in ROUTES:
+        values = latencies[route]
+        result[route] = {
+            'requests': len(values),
+            'errors': errors[route],
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'max_ms': max(values) if values else None,
+            'mean_ms': statistics.fmean(values) if values else None,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--slow-clients', type=int, default=2)
+    parser.add_argument('--slow-byte-interval', type=float, default=0.2)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes:
+        results[mode] = run_mode(mode, args)
+
+    print(f"workers={args.workers} clients={args.clients} slow_clients={args.slow_clients} duration={args.duration}s")
+    print(f"{'mode':<8} {'route':<18} {'requests':>8} {'errors':>6} {'p50':>8} {'p95':>8} {'max':>8}")
+    for mode, routes in results.items():
+        for route, stats in routes.items():
+            print(f"{mode:<8} {route:<18} {stats['requests']:>8} {stats['errors']:>6} "
+                  f"{format_ms(stats['p50_ms']):>8} {format_ms(stats['p95_ms']):>8} {format_ms(stats['max_ms']):>8}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
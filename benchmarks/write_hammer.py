@@ -0,0 +1,135 @@
+"""複数プロセスからの予約・キャンセルの同時書き込み（"database is locked" が出ないことの確認）
+
+1. アプリを一時ディレクトリにコピーし、datagen の合成データを書き込む
+2. --workers のプロセス数ごとに、各プロセスがテストクライアントで同じDBファイルに対して
+   /submit_practice と /cancel_practice を交互に呼び出す（合計 --writes 回）
+3. プロセス数ごとの書き込み/秒とエラー数を表示し、"database is locked" が1件でもあれば失敗する
+
+使い方:
+    python benchmarks/write_hammer.py [--workers 1 4 8] [--writes 800]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from common import copy_app, import_app
+import datagen
+
+
+def date_body(target, **values):
+    return {'year': target.year, 'month': target.month, 'day': target.day, **values}
+
+
+def hammer(workdir, worker_id, writes, seed, start, results):
+    """submit と cancel を writes 回（半分ずつ）行い、(成功数, ロックのエラー数, その他のエラー) を返す"""
+    app_module = import_app(workdir)
+    # 例外を500の応答にせずそのまま受け取り、"database is locked" かどうかを見分ける
+    app_module.app.config['PROPAGATE_EXCEPTIONS'] = True
+    client = app_module.app.test_client()
+    window = app_module.get_date_window()
+    with app_module.app.app_context():
+        slots = app_module.get_calendar_snapshot(window.selectable_start, window.selectable_end)['time_slots']
+    targets = [(d, slot) for d in window.selectable_dates for slot in slots.get(app_module.make_date_key(d), [])]
+    rng = random.Random(seed + worker_id)
+
+    succeeded = 0
+    locked = 0
+    errors = []
+    start.wait()
+    for i in range(writes // 2):
+        target, slot = rng.choice(targets)
+        user_name = f'hammer-{worker_id}-{i % 10}'
+        calls = (
+            ('/submit_practice', date_body(target, user_name=user_name, band_name='hammer', time_slot=slot)),
+            ('/cancel_practice', date_body(target, user_name=user_name, time_slot=slot)),
+        )
+        for path, body in calls:
+            try:
+                response = client.post(path, json=body)
+                message = response.get_data(as_text=True)
+                ok = response.status_code < 400
+            except Exception as e:
+                message = str(e)
+                ok = False
+            if ok:
+                succeeded += 1
+            elif 'database is locked' in message:
+                locked += 1
+            else:
+                errors.append(message[:200])
+    app_module.cleanup_scheduler()
+    results.put((succeeded, locked, errors))
+
+
+def run(workdir, workers, writes, seed):
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(target=hammer, args=(workdir, worker_id, writes // workers, seed, start, results))
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # 全プロセスがアプリを読み込むのを待ってから一斉に書き込ませる
+    time.sleep(3)
+    started = time.perf_counter()
+    start.set()
+    collected = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    succeeded = sum(result[0] for result in collected)
+    return {
+        'workers': workers,
+        'writes': succeeded,
+        'locked_errors': sum(result[1] for result in collected),
+        'other_errors': [error for result in collected for error in result[2]],
+        'writes_per_second': succeeded / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--writes', type=int, default=800, help='プロセス数ごとの書き込みの合計回数')
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='realistic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='結果をJSONで保存するファイル')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='write-hammer-')
+    copy_app(workdir)
+    cwd = os.getcwd()
+    app_module = import_app(workdir)
+    db_path = os.path.join(workdir, 'instance', 'reservations.db')
+    datagen.generate(db_path, args.scale, app_module.get_date_window().today, args.seed)
+    app_module.cleanup_scheduler()
+    os.chdir(cwd)
+
+    results = [run(workdir, workers, args.writes, args.seed) for workers in args.workers]
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"writes={args.writes} scale={args.scale}")
+    print(f"{'workers':>8} {'writes':>7} {'writes/s':>9} {'locked':>7} {'other':>6}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['writes']:>7} {result['writes_per_second']:>9.1f} "
+              f"{result['locked_errors']:>7} {len(result['other_errors']):>6}")
+        for error in result['other_errors'][:5]:
+            print(f'    {error}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+
+    if any(result['locked_errors'] or result['other_errors'] for result in results):
+        sys.exit('書き込みでエラーが発生しました')
+
+
+if __name__ == '__main__':
+    main()
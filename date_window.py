@@ -0,0 +1,142 @@
+"""日付ウィンドウ（受付期間・管理画面の3週間・月カレンダー）の計算
+
+どの画面も「今日を含む週の日曜日」を起点に同じ日付の並びを使うため、
+日本時間の1日につき1回だけ計算してプロセス内で共有する。
+日付が変わると（日本時間の0時）次の呼び出しで自動的に作り直される。
+"""
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+import calendar
+import threading
+
+# 日本時間のタイムゾーン設定（pytz より読み込みが軽い標準ライブラリの zoneinfo を使う）
+JST = ZoneInfo('Asia/Tokyo')
+
+MONTH_NAMES = ['1月', '2月', '3月', '4月', '5月', '6月',
+               '7月', '8月', '9月', '10月', '11月', '12月']
+WEEK_LABELS = ['今週', '来週', '再来週']
+
+# 受付期間（2週間）と管理画面（3週間）の日数
+SELECTABLE_DAYS = 14
+ADMIN_DAYS = 21
+
+# 時間帯変更の週次反映時刻（日曜日19:00）
+WEEKLY_UPDATE_HOUR = 19
+WEEKLY_UPDATE_MINUTE = 0
+
+_sunday_calendar = calendar.Calendar(firstweekday=calendar.SUNDAY)
+
+def get_jst_date():
+    """日本時間での現在の日付を取得"""
+    return datetime.now(JST).date()
+
+def get_jst_datetime():
+    """日本時間での現在の日時を取得"""
+    return datetime.now(JST)
+
+@lru_cache(maxsize=4096)
+def make_date_key(d):
+    """日付から画面・API用の "YYYY-M-D" 形式のキーを生成"""
+    return f"{d.year}-{d.month}-{d.day}"
+
+def parse_date_key(date_key):
+    """"YYYY-M-D" 形式（ゼロ埋めあり・なし両対応）のキーを日付に変換"""
+    y, m, d = [int(x) for x in date_key.split('-')]
+    return date(y, m, d)
+
+def get_week_sunday(d):
+    """指定日を含む週の日曜日"""
+    # weekday() は月曜日=0なので+1して日曜日=0にする（日曜日は7→0）
+    return d - timedelta(days=(d.weekday() + 1) % 7)
+
+@lru_cache(maxsize=32)
+def get_month_grid(year, month):
+    """日曜日始まりの月カレンダー（週ごとの日付リスト、月外は0）"""
+    return tuple(tuple(week) for week in _sunday_calendar.monthdayscalendar(year, month))
+
+class DateWindow:
+    """ある1日（日本時間）を基準にした各画面の日付の並び（読み取り専用として扱う）"""
+
+    def __init__(self, today):
+        self.today = today
+        self.week_sunday = get_week_sunday(today)
+
+        # 受付期間：今週の日曜日から2週間
+        self.selectable_start = self.week_sunday
+        self.selectable_end = self.week_sunday + timedelta(days=SELECTABLE_DAYS - 1)
+        self.selectable_dates = tuple(
+            self.week_sunday + timedelta(days=offset) for offset in range(SELECTABLE_DAYS)
+        )
+        self.valid_dates = frozenset(make_date_key(d) for d in self.selectable_dates)
+
+        # 管理画面：今週の日曜日から3週間
+        self.admin_start = self.week_sunday
+        self.admin_end = self.week_sunday + timedelta(days=ADMIN_DAYS - 1)
+        self.admin_dates = tuple(
+            self.week_sunday + timedelta(days=offset) for offset in range(ADMIN_DAYS)
+        )
+        self.week_dates = tuple(
+            {
+                'date': d,
+                'week_label': WEEK_LABELS[offset // 7] if offset % 7 == 0 else None
+            }
+            for offset, d in enumerate(self.admin_dates)
+        )
+        next_sunday = self.week_sunday + timedelta(weeks=1)
+        self.next_update_time = datetime.combine(
+            next_sunday,
+            datetime.min.time().replace(hour=WEEKLY_UPDATE_HOUR, minute=WEEKLY_UPDATE_MINUTE),
+            tzinfo=JST
+        )
+
+        # 週次更新で時間帯を補充する週（3週間後の週）
+        self.top_up_week_sunday = get_week_sunday(today + timedelta(weeks=3))
+        self.top_up_dates = tuple(
+            self.top_up_week_sunday + timedelta(days=offset) for offset in range(7)
+        )
+
+        self.calendars, self.calendar_start, self.calendar_end = self._build_calendars()
+        # トップページの月カレンダーと受付期間の両方を含む期間（今週の日曜日は前月のことがある）
+        self.display_start = min(self.selectable_start, self.calendar_start)
+        self.display_end = max(self.selectable_end, self.calendar_end)
+
+    def _build_calendars(self):
+        """トップページに表示する月カレンダーと、その表示期間（初日〜末日）"""
+        year = self.today.year
+        month = self.today.month
+        months = [(year, month)]
+        # 残り2週間以内なら来月分も追加
+        last_day = calendar.monthrange(year, month)[1]
+        if last_day - self.today.day < 14:
+            months.append((year + 1, 1) if month == 12 else (year, month + 1))
+
+        calendars = tuple(
+            {
+                'year': y,
+                'month': m,
+                'month_name': MONTH_NAMES[m - 1],
+                'calendar': get_month_grid(y, m)
+            }
+            for y, m in months
+        )
+        last_year, last_month = months[-1]
+        calendar_start = date(year, month, 1)
+        calendar_end = date(last_year, last_month, calendar.monthrange(last_year, last_month)[1])
+        return calendars, calendar_start, calendar_end
+
+_current_window = None
+_window_lock = threading.Lock()
+
+def get_date_window(today=None):
+    """今日（日本時間）の DateWindow を返す。日付が変わるまでは同じものを使い回す"""
+    global _current_window
+    if today is None:
+        today = get_jst_date()
+    window = _current_window
+    if window is not None and window.today == today:
+        return window
+    with _window_lock:
+        if _current_window is None or _current_window.today != today:
+            _current_window = DateWindow(today)
+        return _current_window
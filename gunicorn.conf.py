@@ -0,0 +1,46 @@
+"""gunicorn の設定（render.yaml の startCommand から読み込む）
+
+既定は gevent ワーカー。遅い通信の利用者やSSE接続があっても、
+同じワーカーの他のリクエストは待たされない。
+GUNICORN_WORKER_CLASS=sync で従来の同期ワーカーに戻せる。
+"""
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+# gevent ワーカー1つあたりの同時接続数
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '200'))
+timeout = 120
+keepalive = 2
+
+# アプリはワーカーごとに読み込む（gevent のモンキーパッチをアプリの読み込み前に行うため、preload はしない）
+preload_app = False
+
+# /metrics で全ワーカーの値を合算するため、prometheus_client のマルチプロセスモードを使う
+# （値は各ワーカーがこのディレクトリのファイルに書き込む。アプリの読み込み前に設定する必要がある）
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'prometheus')
+)
+
+
+def on_starting(server):
+    # 前回の起動時の値が合算されないよう空にする
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    # gevent ワーカーで PostgreSQL を使う場合は、psycopg2 の通信待ちで他のリクエストを止めないよう
+    # 待ち合わせを gevent に任せる（アプリの読み込みで最初の接続を作る前に設定する）
+    database_urls = (os.environ.get('DATABASE_URL', ''), os.environ.get('ARCHIVE_DATABASE_URL', ''))
+    if worker_class == 'gevent' and any(url.startswith('postgres') for url in database_urls):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
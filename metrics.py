@@ -0,0 +1,178 @@
+"""Prometheus形式のメトリクス（/metrics）
+
+ルートごとの応答時間・リクエストごとのSQL実行数とDB時間・スケジューラーのジョブの
+所要時間と結果・キャッシュのヒット率を記録する。
+gunicorn では gunicorn.conf.py で PROMETHEUS_MULTIPROC_DIR を設定し、
+各ワーカーの値をファイル経由で合算して返す（設定がなければこのプロセスの値だけ）。
+"""
+from functools import wraps
+import os
+import re
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'リクエストの処理時間（ストリーミング応答は本文の送信前まで）',
+    ['method', 'route']
+)
+REQUESTS = Counter(
+    'http_requests_total',
+    'リクエスト数',
+    ['method', 'route', 'status']
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements',
+    '1リクエストで実行したSQL文の数',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_seconds',
+    '1リクエストでSQLの実行にかかった時間の合計',
+    ['route'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+JOB_DURATION = Histogram(
+    'scheduler_job_duration_seconds',
+    'スケジューラーのジョブの所要時間',
+    ['job'],
+    buckets=(.05, .1, .5, 1, 5, 10, 30, 60, 120, 300)
+)
+JOB_RUNS = Counter(
+    'scheduler_job_runs_total',
+    'スケジューラーのジョブの実行回数（outcome: success, error, missed）',
+    ['job', 'outcome']
+)
+JOB_LAST_SUCCESS = Gauge(
+    'scheduler_job_last_success_timestamp_seconds',
+    'スケジューラーのジョブが最後に成功した時刻（UNIX時間）',
+    ['job'],
+    multiprocess_mode='max'
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'プロセス内キャッシュの参照回数（result: hit, miss）',
+    ['cache', 'result']
+)
+CACHE_HIT_RATIO = Gauge(
+    'cache_hit_ratio',
+    'プロセス内キャッシュのヒット率（ワーカーごと）',
+    ['cache'],
+    multiprocess_mode='liveall'
+)
+CACHE_ENTRIES = Gauge(
+    'cache_entries',
+    'プロセス内キャッシュの件数（ワーカーごと）',
+    ['cache'],
+    multiprocess_mode='liveall'
+)
+
+# 遅いリクエストのログに出すSQL文の最大文字数
+SLOW_REQUEST_SQL_MAX_LENGTH = 500
+_WHITESPACE = re.compile(r'\s+')
+
+
+class RequestMetrics:
+    """1リクエストの間に実行されたSQLの数と時間を集計する
+
+    record_statements が真の場合は、遅いリクエストのログ用にSQL文も記録する。
+    """
+
+    def __init__(self, record_statements=False):
+        self.started = time.perf_counter()
+        self.statement_count = 0
+        self.db_seconds = 0.0
+        self.statements = [] if record_statements else None
+
+    def add_statement(self, statement, seconds, executemany=False):
+        self.statement_count += 1
+        self.db_seconds += seconds
+        if self.statements is not None:
+            self.statements.append((statement, seconds, executemany))
+
+    def finish(self, method, route, status):
+        """処理時間を返し、メトリクスに記録する"""
+        elapsed = time.perf_counter() - self.started
+        REQUEST_LATENCY.labels(method, route).observe(elapsed)
+        REQUESTS.labels(method, route, str(status)).inc()
+        REQUEST_SQL_STATEMENTS.labels(route).observe(self.statement_count)
+        REQUEST_DB_SECONDS.labels(route).observe(self.db_seconds)
+        return elapsed
+
+    def slow_log_fields(self, method, path, status, elapsed):
+        """遅いリクエストのログの項目（実行したSQLの一覧付き）"""
+        statements = []
+        for statement, seconds, executemany in self.statements or ():
+            sql = _WHITESPACE.sub(' ', statement).strip()
+            if len(sql) > SLOW_REQUEST_SQL_MAX_LENGTH:
+                sql = sql[:SLOW_REQUEST_SQL_MAX_LENGTH] + '...'
+            statements.append({'ms': round(seconds * 1000, 3), 'executemany': executemany, 'sql': sql})
+        return {
+            'method': method,
+            'path': path,
+            'status': status,
+            'elapsed_ms': round(elapsed * 1000, 1),
+            'sql_count': self.statement_count,
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'statements': statements,
+        }
+
+
+def observe_job(job_id):
+    """スケジューラーのジョブの所要時間と結果を記録するデコレーター（例外はそのまま送出する）"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                JOB_RUNS.labels(job_id, 'error').inc()
+                raise
+            finally:
+                JOB_DURATION.labels(job_id).observe(time.perf_counter() - started)
+            JOB_RUNS.labels(job_id, 'success').inc()
+            JOB_LAST_SUCCESS.labels(job_id).set(time.time())
+            return result
+        return wrapper
+    return decorator
+
+
+def record_missed_job(job_id):
+    JOB_RUNS.labels(job_id, 'missed').inc()
+
+
+class CacheMetrics:
+    """VersionedLRUCache 1つ分のメトリクス（参照のたびにラベルを引かないよう先に作っておく）"""
+
+    def __init__(self, name):
+        self.hit = CACHE_REQUESTS.labels(name, 'hit')
+        self.miss = CACHE_REQUESTS.labels(name, 'miss')
+        self.hit_ratio = CACHE_HIT_RATIO.labels(name)
+        self.entries = CACHE_ENTRIES.labels(name)
+
+    def observe(self, hit, hits, misses, entries):
+        (self.hit if hit else self.miss).inc()
+        self.hit_ratio.set(hits / (hits + misses))
+        self.entries.set(entries)
+
+
+def render_metrics():
+    """Prometheusのテキスト形式（本文, Content-Type）を返す"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
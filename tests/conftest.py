@@ -0,0 +1,50 @@
+"""テスト共通のフィクスチャ
+
+アプリは一時ディレクトリにコピーして読み込む（リポジトリの instance/ のDBには触れない）。
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from common import copy_app, import_app  # noqa: E402
+import datagen  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    workdir = str(tmp_path_factory.mktemp('app'))
+    copy_app(workdir)
+    cwd = os.getcwd()
+    module = import_app(workdir)
+    assert os.path.dirname(os.path.abspath(module.__file__)) == workdir
+    yield module
+    module.cleanup_scheduler()
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope='session')
+def db_path(app_module):
+    return os.path.join(app_module.app.instance_path, 'reservations.db')
+
+
+def bump_data_version(db_path):
+    """別の接続からデータバージョンを進め、プロセス内のキャッシュを無効にする"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        with conn:
+            conn.execute('UPDATE data_version SET version = version + 1')
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def seed(app_module, db_path):
+    """datagen の合成データで予約・時間枠を置き換える"""
+    def generate(scale='small', **kwargs):
+        return datagen.generate(db_path, scale, app_module.get_date_window().today, **kwargs)
+    return generate
@@ -0,0 +1,63 @@
+"""管理画面の「デフォルト時間帯を設定」が使う1日分の時間枠（保存した規則・祝日に従う）"""
+import sqlite3
+from datetime import timedelta
+
+from conftest import bump_data_version
+
+
+def default_slots(client, target):
+    response = client.get('/admin/default_time_slots', query_string={'date': target.isoformat()})
+    assert response.status_code == 200
+    return response.json['slots']
+
+
+def test_default_slots_follow_stored_rules(app_module):
+    client = app_module.app.test_client()
+    target = app_module.get_date_window().today + timedelta(days=200)
+    name = app_module.DAY_TYPE_NAMES[target.weekday()]
+    original = {
+        'rules': {
+            name: app_module.DEFAULT_SLOT_RULES[target.weekday()],
+            'holiday': app_module.DEFAULT_SLOT_RULES[app_module.HOLIDAY_DAY_TYPE],
+        },
+        'holidays': {'remove': [target.isoformat()]},
+    }
+    try:
+        assert client.post('/admin/slot_rules', json={'rules': {name: ['9:00〜10:00']}}).status_code == 200
+        assert default_slots(client, target) == ['9:00〜10:00']
+
+        client.post('/admin/slot_rules', json={
+            'rules': {'holiday': ['13:00〜15:00']},
+            'holidays': {'add': [{'date': target.isoformat(), 'name': 'テスト'}]},
+        })
+        assert default_slots(client, target) == ['13:00〜15:00']
+    finally:
+        client.post('/admin/slot_rules', json=original)
+
+    # 画面側に曜日ごとの時間帯を持たない
+    assert "'16:50〜18:00'" not in client.get('/admin').get_data(as_text=True)
+
+
+def test_default_slots_for_cleared_date(app_module, db_path, seed):
+    """時間帯を空にした日付（既存の時間枠・空にする変更予定あり）にも規則の時間帯を返す"""
+    seed()
+    client = app_module.app.test_client()
+    target = app_module.get_date_window().selectable_dates[-1]
+    assert client.post('/admin/update_time_slots', json={'date': target.isoformat(), 'slots': []}).status_code == 200
+    try:
+        assert client.get('/admin/time_slot_plan', query_string={
+            'start': target.isoformat(), 'end': target.isoformat()
+        }).json['dates'] == {}
+        assert default_slots(client, target) == app_module.DEFAULT_SLOT_RULES[target.weekday()]
+    finally:
+        conn = sqlite3.connect(db_path, timeout=30)
+        with conn:
+            conn.execute('DELETE FROM time_slot_change')
+        conn.close()
+        bump_data_version(db_path)
+
+
+def test_default_slots_rejects_invalid_date(app_module):
+    client = app_module.app.test_client()
+    assert client.get('/admin/default_time_slots', query_string={'date': '2026-13-40'}).status_code == 400
+    assert client.get('/admin/default_time_slots').status_code == 400
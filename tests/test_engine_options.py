@@ -0,0 +1,33 @@
+"""接続先ごとのエンジンの設定（インメモリのSQLiteでもアプリを起動できる）"""
+import os
+import subprocess
+import sys
+
+from common import copy_app
+
+CHECK = '''
+import app
+app.create_app()
+client = app.app.test_client()
+assert client.get('/').status_code == 200
+assert client.get('/admin').status_code == 200
+with app.app.app_context():
+    print(type(app.db.engine.pool).__name__)
+'''
+
+
+def test_app_starts_with_in_memory_sqlite(tmp_path):
+    copy_app(str(tmp_path))
+    env = dict(os.environ, DATABASE_URL='sqlite://', LOG_LEVEL='WARNING')
+    result = subprocess.run([sys.executable, '-c', CHECK], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == 'StaticPool'
+
+
+def test_pool_size_only_for_queue_pool(app_module):
+    for url in ('sqlite://', 'sqlite:///:memory:', 'sqlite:///file:test?mode=memory&uri=true'):
+        assert 'pool_size' not in app_module.build_engine_options(url)
+    for url in ('sqlite:///reservations.db', 'postgresql://user@localhost/club'):
+        options = app_module.build_engine_options(url)
+        assert {'pool_size', 'max_overflow', 'pool_timeout'} <= options.keys()
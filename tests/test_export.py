@@ -0,0 +1,37 @@
+"""予約のエクスポート（CSVはExcelで開いても利用者の入力が数式として実行されない）"""
+import csv
+import io
+import json
+from datetime import timedelta
+
+
+def test_csv_export_escapes_formula_cells(app_module):
+    client = app_module.app.test_client()
+    target = app_module.get_date_window().today + timedelta(days=250)
+    names = {
+        '=HYPERLINK("http://example.com")': 'band',
+        '+1': '-band',
+        '@SUM(A1)': '=1+1',
+        'ふつうの名前': 'バンド',
+    }
+    for user_name, band_name in names.items():
+        response = client.post('/submit_practice', json={
+            'year': target.year, 'month': target.month, 'day': target.day,
+            'user_name': user_name, 'band_name': band_name, 'time_slot': 'export'
+        })
+        assert response.status_code == 200
+    query = {'start': target.isoformat(), 'end': target.isoformat()}
+
+    text = client.get('/admin/export_reservations', query_string=query).get_data(as_text=True)
+    rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+    assert {row['user_name']: row['band_name'] for row in rows} == {
+        '\'=HYPERLINK("http://example.com")': 'band',
+        "'+1": "'-band",
+        "'@SUM(A1)": "'=1+1",
+        'ふつうの名前': 'バンド',
+    }
+
+    # NDJSON はプログラムで読むため元の値のまま
+    text = client.get('/admin/export_reservations', query_string={**query, 'format': 'ndjson'}).get_data(as_text=True)
+    records = [json.loads(line) for line in text.splitlines()]
+    assert {record['user_name']: record['band_name'] for record in records} == names
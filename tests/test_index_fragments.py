@@ -0,0 +1,43 @@
+"""トップページの月カレンダーの描画済みHTML（断片キャッシュ）"""
+from sqlalchemy.exc import OperationalError
+
+from conftest import bump_data_version
+
+
+def test_failed_load_is_not_cached(app_module, db_path, seed, monkeypatch):
+    """予約データの取得に一度失敗しても、次のリクエストでは時間枠を表示する"""
+    seed('small')
+    bump_data_version(db_path)
+    client = app_module.app.test_client()
+
+    def fail(*args, **kwargs):
+        raise OperationalError('SELECT', {}, Exception('database is locked'))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module, 'get_calendar_snapshot', fail)
+        response = client.get('/')
+    assert response.status_code == 200
+    assert 'class="time-label"' not in response.get_data(as_text=True)
+
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'class="time-label"' in response.get_data(as_text=True)
+
+
+def test_version_lookup_failure_renders_empty_calendar(app_module, seed, monkeypatch):
+    """データバージョンを取得できない場合も500にせず、時間枠なしのカレンダーを表示する"""
+    seed('small')
+    client = app_module.app.test_client()
+
+    def fail():
+        raise OperationalError('SELECT', {}, Exception('unable to open database file'))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_module, 'get_data_version', fail)
+        response = client.get('/')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'class="day' in body and 'class="time-label"' not in body
+
+    response = client.get('/')
+    assert 'class="time-label"' in response.get_data(as_text=True)
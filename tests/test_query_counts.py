@@ -0,0 +1,64 @@
+"""ルートごとのSQL文の数（表示する期間の予約の数によらず一定であること）"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import bump_data_version
+
+
+@contextmanager
+def recorded_statements(app_module):
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+
+
+def route_paths(app_module):
+    target = app_module.get_date_window().selectable_dates[7]
+    return {
+        'index': '/',
+        'admin': '/admin',
+        'get_time_slots': f'/get_time_slots/{target.year}/{target.month}/{target.day}',
+    }
+
+
+# キャッシュなし（データバージョンが変わった直後）の数
+# index: バージョン・時間枠・予約数 / admin: バージョン・時間枠・予約数・予約・一時保存された変更
+# get_time_slots: バージョン・時間枠・予約数・予約
+COLD_QUERIES = {'index': 3, 'admin': 5, 'get_time_slots': 4}
+
+
+@pytest.mark.parametrize('scale', ['small', 'realistic'])
+@pytest.mark.parametrize('route', sorted(COLD_QUERIES))
+def test_cold_query_count(app_module, db_path, seed, scale, route):
+    seed(scale)
+    path = route_paths(app_module)[route]
+    client = app_module.app.test_client()
+    bump_data_version(db_path)
+    with recorded_statements(app_module) as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert len(statements) == COLD_QUERIES[route], statements
+
+
+@pytest.mark.parametrize('route', sorted(COLD_QUERIES))
+def test_warm_query_count(app_module, seed, route):
+    """キャッシュがあればデータバージョンの確認だけ"""
+    seed('realistic')
+    path = route_paths(app_module)[route]
+    client = app_module.app.test_client()
+    client.get(path)
+    with recorded_statements(app_module) as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert len(statements) == 1, statements
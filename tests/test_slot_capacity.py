@@ -0,0 +1,34 @@
+"""時間枠の定員（その時間枠の最初の予約にも定員を適用する）"""
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize('capacity, expected', [(0, [409, 409]), (1, [200, 409])])
+def test_capacity_applies_to_first_booking(app_module, monkeypatch, capacity, expected):
+    monkeypatch.setattr(app_module, 'SLOT_CAPACITY', capacity)
+    client = app_module.app.test_client()
+    # まだ予約数の行がない日付・時間枠
+    target = app_module.get_date_window().today + timedelta(days=300)
+    slot = f'capacity-{capacity}'
+    statuses = [
+        client.post('/submit_practice', json={
+            'year': target.year, 'month': target.month, 'day': target.day,
+            'user_name': user_name, 'band_name': 'band', 'time_slot': slot
+        }).status_code
+        for user_name in ('first', 'second')
+    ]
+    assert statuses == expected
+
+    with app_module.app.app_context():
+        rows = app_module.db.session.execute(
+            app_module.db.select(app_module.PracticeRequest.user_name)
+            .where(app_module.PracticeRequest.date == target, app_module.PracticeRequest.time_slot == slot)
+        ).scalars().all()
+        count = app_module.db.session.execute(
+            app_module.db.select(app_module.SlotOccupancy.count)
+            .where(app_module.SlotOccupancy.date == target, app_module.SlotOccupancy.slot == slot)
+        ).scalar()
+        app_module.db.session.remove()
+    assert len(rows) == capacity
+    assert (count or 0) == capacity
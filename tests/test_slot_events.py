@@ -0,0 +1,43 @@
+"""SSEの変更通知（一括作成で多くの日付が変わっても購読者を切断しない）"""
+import queue
+import sqlite3
+from datetime import timedelta
+
+from conftest import bump_data_version
+
+
+def test_bulk_generate_sends_one_message_within_display_window(app_module, db_path, seed):
+    seed('small')
+    window = app_module.get_date_window()
+    # 表示期間の日付にも作成されるよう、今週の日曜日以降の時間枠を消しておく
+    conn = sqlite3.connect(db_path, timeout=30)
+    with conn:
+        conn.execute('DELETE FROM time_slot WHERE date >= ?', (window.admin_start.isoformat(),))
+    conn.close()
+    bump_data_version(db_path)
+
+    # ポーリングのスレッドは起動せず、購読者を直接登録して poll() を呼ぶ
+    broker = app_module.SlotEventBroker(queue_size=4)
+    subscriber = queue.Queue(maxsize=broker.queue_size)
+    broker._subscribers.add(subscriber)
+    broker.poll()
+
+    client = app_module.app.test_client()
+    end = window.admin_start + timedelta(days=199)
+    response = client.post('/admin/generate_time_slots', json={
+        'start': window.admin_start.isoformat(), 'end': end.isoformat()
+    })
+    assert response.status_code == 200
+    assert response.json['date_count'] > broker.queue_size
+    broker.poll()
+
+    assert broker.subscriber_count == 1
+    message = subscriber.get_nowait()
+    assert subscriber.empty()
+    shown = {
+        app_module.make_date_key(window.display_start + timedelta(days=offset))
+        for offset in range((max(window.display_end, window.admin_end) - window.display_start).days + 1)
+    }
+    dates = [delta['date'] for delta in message['deltas']]
+    assert dates and set(dates) <= shown
+    assert all(delta['time_slots'] for delta in message['deltas'])
@@ -0,0 +1,19 @@
+"""受付期間（2週間分）の時間枠をまとめて返す /get_time_slots_range"""
+import sys
+from datetime import date, timedelta
+
+
+def test_range_includes_days_before_the_first_of_the_month(app_module, seed, monkeypatch):
+    """今週の日曜日が前月の日付でも、1日ずつ取得した場合と同じ内容を返す"""
+    date_window = sys.modules[app_module.get_date_window.__module__]
+    monkeypatch.setattr(date_window, 'get_jst_date', lambda: date(2026, 10, 1))
+    seed('realistic')
+    client = app_module.app.test_client()
+
+    payload = client.get('/get_time_slots_range').get_json()
+    assert payload['start'] == '2026-09-27'
+    for offset in range(14):
+        target = date(2026, 9, 27) + timedelta(days=offset)
+        single = client.get(f'/get_time_slots/{target.year}/{target.month}/{target.day}').get_json()
+        assert single['time_slots']
+        assert payload['dates'][app_module.make_date_key(target)] == single['time_slots']
@@ -0,0 +1,109 @@
+"""1人1日1件の予約（一意インデックスと INSERT ... ON CONFLICT DO UPDATE）"""
+import multiprocessing
+import sqlite3
+from collections import Counter
+
+from sqlalchemy import text
+
+from common import import_app
+
+USERS = [f'stress-{i}' for i in range(10)]
+DATES = 20
+PROCESSES = 4
+
+
+def submit_every_pair(workdir, worker_id, targets, start, results):
+    """全ての (日付, 名前) を1回ずつ、プロセスごとに違う時間帯で送信する"""
+    app_module = import_app(workdir)
+    client = app_module.app.test_client()
+    statuses = Counter()
+    start.wait()
+    for target, slots in targets:
+        slot = slots[worker_id % len(slots)]
+        for user_name in USERS:
+            response = client.post('/submit_practice', json={
+                'year': target.year, 'month': target.month, 'day': target.day,
+                'user_name': user_name, 'band_name': f'band-{worker_id}', 'time_slot': slot
+            })
+            statuses[response.status_code] += 1
+    app_module.cleanup_scheduler()
+    results.put(dict(statuses))
+
+
+def test_concurrent_submits_leave_one_row_per_user_and_day(app_module, db_path, seed):
+    seed('small')
+    window = app_module.get_date_window()
+    with app_module.app.app_context():
+        slots = app_module.load_calendar_data(window.admin_start, window.admin_end)['time_slots']
+    targets = [(d, slots[app_module.make_date_key(d)]) for d in window.admin_dates[:DATES]]
+
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    workdir = app_module.app.root_path
+    processes = [
+        context.Process(target=submit_every_pair, args=(workdir, worker_id, targets, start, results))
+        for worker_id in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    statuses = Counter()
+    for _ in processes:
+        statuses.update(results.get(timeout=120))
+    for process in processes:
+        process.join()
+    assert statuses == {200: PROCESSES * DATES * len(USERS)}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        counts = conn.execute(
+            "SELECT COUNT(*) FROM practice_request WHERE user_name LIKE 'stress-%' GROUP BY date, user_name"
+        ).fetchall()
+    finally:
+        conn.close()
+    assert len(counts) == DATES * len(USERS)
+    assert {count for (count,) in counts} == {1}
+    # 上書きのたびに予約数も付け替えられ、集計とずれていない
+    with app_module.app.app_context():
+        assert app_module.reconcile_slot_occupancy() == []
+
+
+def unique_index_names(app_module):
+    inspector = app_module.db.inspect(app_module.db.engine)
+    return {index['name'] for index in inspector.get_indexes('practice_request') if index['unique']}
+
+
+def test_migration_removes_duplicates_and_creates_unique_index(app_module, seed):
+    """一意インデックスがない以前のDBでは、idが最小の行を残して一意インデックスを作成する"""
+    seed('small')
+    target = app_module.get_date_window().admin_dates[3]
+    with app_module.app.app_context():
+        with app_module.db.engine.begin() as conn:
+            conn.execute(text('DROP INDEX uq_practice_request_date_user_name'))
+            conn.execute(text('CREATE INDEX ix_practice_request_date_user_name ON practice_request (date, user_name)'))
+            for band_name in ('first', 'second', 'third'):
+                conn.execute(text(
+                    'INSERT INTO practice_request (date, user_name, band_name, time_slot) '
+                    "VALUES (:date, 'duplicate', :band_name, 'slot')"
+                ), {'date': target, 'band_name': band_name})
+        assert 'uq_practice_request_date_user_name' not in unique_index_names(app_module)
+
+        assert app_module.migrate_practice_request_unique_index() == 2
+        assert 'uq_practice_request_date_user_name' in unique_index_names(app_module)
+        rows = app_module.db.session.execute(text(
+            "SELECT band_name FROM practice_request WHERE user_name = 'duplicate'"
+        )).scalars().all()
+        assert rows == ['first']
+        # 移行済みなら何もしない
+        assert app_module.migrate_practice_request_unique_index() == 0
+
+
+def test_cancel_rejects_invalid_date(app_module):
+    """submit_practice と同じく、日付がない・不正な場合は400を返す"""
+    client = app_module.app.test_client()
+    body = {'month': 10, 'day': 20, 'user_name': 'name', 'time_slot': '16:50〜18:00'}
+    for date_fields in ({}, {'year': 'x'}, {'year': 2026, 'month': 13}, {'year': None}):
+        response = client.post('/cancel_practice', json={**body, **date_fields})
+        assert response.status_code == 400
+        assert response.json['message'] == '不正な日付です'